@@ -2,9 +2,9 @@
 
 r"""Anchors stuff"""
 
-import numpy as np
+from collections.abc import Mapping
 
-from transformations.conversions import p3_to_p4, p4_to_p3, v4_to_v3, v3_to_v4
+import numpy as np
 
 
 class Anchor(object):
@@ -12,6 +12,10 @@ class Anchor(object):
 
     u and v must be orthogonal and unitary
 
+    The point, the vectors and the virtual 3rd vector w = u x v are stored
+    as the rows of a single read-only (4, 3) array. The accessors return
+    read-only views of its rows.
+
     Parameters
     ----------
     p : iterable
@@ -20,32 +24,43 @@ class Anchor(object):
     name : str
 
     """
+    __slots__ = ('_data', '_name')
+
     def __init__(self, p, u, v, name):
         assert len(p) == len(u) == len(v) == 3
-        assert abs(np.dot(np.array(u), np.array(v))) < 1e-6
-        self._p = p
-        self._u = u
-        self._v = v
+        data = np.empty((4, 3))
+        data[0] = p
+        data[1] = u
+        data[2] = v
+        assert abs(np.dot(data[1], data[2])) < 1e-6
+        data[3] = np.cross(data[1], data[2])
+        data.flags.writeable = False
+        self._data = data
         self._name = name
 
+    @property
+    def data(self):
+        r"""Read-only (4, 3) array of the rows p, u, v and w"""
+        return self._data
+
     @property
     def p(self):
-        return np.array(self._p)
+        return self._data[0]
 
     @property
     def u(self):
         r"""1st anchor vector, normally going out of the part"""
-        return np.array(self._u)
+        return self._data[1]
 
     @property
     def v(self):
         r"""2nd anchor vector, normally tangential to the part surface"""
-        return np.array(self._v)
+        return self._data[2]
 
     @property
     def w(self):
         r"""Virtual 3rd anchor vector"""
-        return np.cross(self.u, self.v)
+        return self._data[3]
 
     @property
     def name(self):
@@ -60,14 +75,256 @@ class Anchor(object):
 
         """
         assert np.shape(m) == (4, 4)
-        return Anchor(p=p4_to_p3(np.dot(m, p3_to_p4(self.p))),
-                      u=v4_to_v3(np.dot(m, v3_to_v4(self.u))),
-                      v=v4_to_v3(np.dot(m, v3_to_v4(self.v))),
-                      name=self.name)
+        m = np.asarray(m)
+        # p, u and v in a single product, the translation applies to p only
+        x = np.dot(self._data[:3], m[:3, :3].T)
+        x[0] += m[:3, 3]
+        return Anchor(p=x[0], u=x[1], v=x[2], name=self.name)
 
+    @classmethod
+    def _from_data(cls, data, name):
+        r"""Anchor sharing a read-only (4, 3) array of p, u, v and w rows,
+        without checks"""
+        anchor = cls.__new__(cls)
+        anchor._data = data
+        anchor._name = name
+        return anchor
 
-def anchor_transformation(anchor_0, anchor_1):
-    r"""
+    def __repr__(self):
+        return 'Anchor(p=%r, u=%r, v=%r, name=%r)' % (
+            tuple(self.p), tuple(self.u), tuple(self.v), self.name)
+
+
+class AnchorSet(Mapping):
+    r"""Anchors of a part, stored as a structure of arrays
+
+    The points and the vectors of all anchors are the (N, 3) C contiguous
+    arrays p, u, v and w, the anchors are looked up by name. The set
+    behaves as a read-only mapping of names to Anchors.
+
+    Parameters
+    ----------
+    anchors : iterable of Anchors
+        The anchor names must be unique
+
+    Examples
+    --------
+    >>> from transformations.transformations import random_rotation_matrix
+    >>> anchors = [Anchor([1, 2, 3], [1, 0, 0], [0, 1, 0], 'a'),
+    ...            Anchor([4, 5, 6], [0, 0, 1], [1, 0, 0], 'b')]
+    >>> anchor_set = AnchorSet(anchors)
+    >>> anchor_set.names, anchor_set.index('b'), 'c' in anchor_set
+    (('a', 'b'), 1, False)
+    >>> np.array_equal(anchor_set.w, [anchor.w for anchor in anchors])
+    True
+
+    All anchors are transformed at once, as by Anchor.transform:
+
+    >>> m = random_rotation_matrix()
+    >>> m[:3, 3] = [7, 8, 9]
+    >>> transformed = anchor_set.transform(m)
+    >>> all(np.allclose(transformed[anchor.name].data,
+    ...                 anchor.transform(m).data) for anchor in anchors)
+    True
+    >>> transformed.names == anchor_set.names
+    True
+    >>> AnchorSet(anchors + [anchors[0]])
+    Traceback (most recent call last):
+     ...
+    ValueError: duplicate anchor names
+
+    """
+    __slots__ = ('_data', '_names', '_index')
+
+    def __init__(self, anchors=()):
+        anchors = list(anchors)
+        data = np.empty((4, len(anchors), 3))
+        for i, anchor in enumerate(anchors):
+            data[:, i] = anchor.data
+        self._init(data, [anchor.name for anchor in anchors])
+
+    def _init(self, data, names):
+        data.flags.writeable = False
+        self._data = data
+        self._names = tuple(names)
+        self._index = {name: i for i, name in enumerate(self._names)}
+        if len(self._index) != len(self._names):
+            raise ValueError('duplicate anchor names')
+
+    @classmethod
+    def from_arrays(cls, p, u, v, names):
+        r"""AnchorSet from (N, 3) arrays of points and vectors
+
+        Parameters
+        ----------
+        p : array of shape (N, 3)
+        u : array of shape (N, 3)
+        v : array of shape (N, 3)
+            u and v must be orthogonal and unitary
+        names : iterable of N str
+
+        """
+        data = np.empty((4, len(p), 3))
+        data[0] = p
+        data[1] = u
+        data[2] = v
+        assert np.all(np.abs(np.sum(data[1] * data[2], axis=1)) < 1e-6)
+        data[3] = np.cross(data[1], data[2])
+        anchor_set = cls.__new__(cls)
+        anchor_set._init(data, names)
+        return anchor_set
+
+    @property
+    def names(self):
+        return self._names
+
+    @property
+    def p(self):
+        return self._data[0]
+
+    @property
+    def u(self):
+        return self._data[1]
+
+    @property
+    def v(self):
+        return self._data[2]
+
+    @property
+    def w(self):
+        return self._data[3]
+
+    def index(self, name):
+        r"""Row of the anchor in the p, u, v and w arrays"""
+        return self._index[name]
+
+    def __getitem__(self, name):
+        return Anchor._from_data(self._data[:, self._index[name]], name)
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __repr__(self):
+        return 'AnchorSet(%r)' % (list(self.values()), )
+
+    def transform(self, m):
+        r"""Tranform all anchors with a 4x4 matrix
+
+        p, u and v of all anchors are transformed by a single (3N, 3) x (3, 3)
+        product, the translation is added to the points.
+
+        Returns
+        -------
+        A new AnchorSet with the same names
+
+        """
+        assert np.shape(m) == (4, 4)
+        m = np.asarray(m)
+        n = len(self._names)
+        data = np.empty((4, n, 3))
+        np.dot(self._data[:3].reshape(3 * n, 3), m[:3, :3].T,
+               out=data[:3].reshape(3 * n, 3))
+        data[0] += m[:3, 3]
+        data[3] = np.cross(data[1], data[2])
+        anchor_set = AnchorSet.__new__(AnchorSet)
+        anchor_set._data = data
+        data.flags.writeable = False
+        anchor_set._names = self._names
+        anchor_set._index = self._index
+        return anchor_set
+
+
+# Mating flips u and w (hence keeps the frame right handed) and keeps v,
+# signs of the u, v and w rows of Anchor.data
+_MATING_FLIP = np.array([[-1.], [1.], [-1.]])
+
+
+def frame_matrix(p, u, v):
+    r"""4x4 matrix that maps the world frame onto the frame defined by
+    the point p and the perpendicular vectors u and v
+
+    The columns of the rotation part are u, v and w = u x v, normalized
+
+    Parameters
+    ----------
+    p : iterable
+    u : iterable
+    v : iterable
+
+    Returns
+    -------
+    4x4 matrix
+
+    """
+    u = np.asarray(u, dtype=float)
+    v = np.asarray(v, dtype=float)
+    m = np.identity(4)
+    m[:3, 0] = u / np.linalg.norm(u)
+    m[:3, 1] = v / np.linalg.norm(v)
+    m[:3, 2] = np.cross(m[:3, 0], m[:3, 1])
+    m[:3, 3] = p
+    return m
+
+
+def anchor_transformation(anchor_0, anchor_1, check=False):
+    r"""Transformation matrix that mates anchor_0 onto anchor_1
+
+    The matrix maps p0 on p1, u0 on -u1 and v0 on v1. It is computed in
+    closed form as frame_1 . flip . inverse(frame_0), where the rotations of
+    the frames are the u, v and w rows of the anchor data, transposed.
+
+    Parameters
+    ----------
+    anchor_0 : Anchor
+    anchor_1 : Anchor
+    check : bool
+        If True, cross-check the result against the point set superimposition
+        of p, p + u and p + v
+
+    Returns
+    -------
+    4x4 matrix
+
+    Raises
+    ------
+    AssertionError
+        If check is True and the results differ, also under python -O
+
+    Examples
+    --------
+    >>> from transformations.transformations import random_rotation_matrix
+    >>> anchor_0 = Anchor([1, 2, 3], [1, 0, 0], [0, 1, 0], 'a')
+    >>> anchor_1 = anchor_0.transform(random_rotation_matrix())
+    >>> m = anchor_transformation(anchor_0, anchor_1, check=True)
+    >>> mated = anchor_0.transform(m)
+    >>> np.allclose(mated.p, anchor_1.p), np.allclose(mated.u, -anchor_1.u)
+    (True, True)
+    >>> np.allclose(mated.v, anchor_1.v)
+    True
+
+    """
+    # u, v and w are orthonormal, the inverse rotation is the transpose
+    r = np.dot((anchor_1.data[1:] * _MATING_FLIP).T, anchor_0.data[1:])
+    m = np.identity(4)
+    m[:3, :3] = r
+    m[:3, 3] = anchor_1.p - np.dot(r, anchor_0.p)
+    if check:
+        expected = _superimposition_anchor_transformation(anchor_0, anchor_1)
+        if not np.allclose(m, expected):
+            raise AssertionError('closed form matrix\n%s\ndiffers from '
+                                 'superimposition matrix\n%s' % (m, expected))
+    return m
+
+
+def _superimposition_anchor_transformation(anchor_0, anchor_1):
+    r"""Reference implementation of anchor_transformation, registering 3
+    points of each anchor
 
     Parameters
     ----------
@@ -86,4 +343,9 @@ def anchor_transformation(anchor_0, anchor_1):
     v1 = np.array(
         [anchor_1.p, anchor_1.p - anchor_1.u, anchor_1.p + anchor_1.v])
 
-    return superimposition_matrix(v0.T, v1.T, scale=False, usesvd=False)
+    return superimposition_matrix(v0.T, v1.T, scale=False, usesvd='auto')
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
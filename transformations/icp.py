@@ -0,0 +1,153 @@
+# coding: utf-8
+
+r"""Iterative closest point (ICP) alignment of point clouds
+
+Each iteration pairs the points of the source cloud with their nearest
+neighbours in the target cloud (KD-tree search, requires scipy) and solves
+the pairs with superimposition_matrix.
+"""
+
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from transformations.points import transform_points
+from transformations.transformations import superimposition_matrix
+
+IcpResult = namedtuple('IcpResult', ['matrix',
+                                     'rmse',
+                                     'iterations',
+                                     'converged',
+                                     'inliers',
+                                     'iteration_times'])
+IcpResult.__doc__ = r"""Result of icp
+
+matrix : 4x4 matrix that transforms the source cloud onto the target cloud
+rmse : root mean square distance of the paired points at the last iteration
+iterations : number of iterations
+converged : True if the convergence criteria were met
+inliers : number of pairs used at the last iteration
+iteration_times : list of the durations of the iterations, in seconds
+"""
+
+
+def icp(source, target, initial=None, max_iterations=50, tolerance=1e-6,
+        max_distance=None, trim_fraction=None, sample=None, usesvd=True,
+        workers=-1, tree=None, random_state=None):
+    r"""Point-to-point ICP alignment of a source cloud on a target cloud
+
+    Parameters
+    ----------
+    source : array of shape (N, 3)
+    target : array of shape (M, 3)
+    initial : 4x4 matrix or None
+        Initial placement of the source cloud, e.g. its nominal CAD placement
+    max_iterations : int
+    tolerance : float
+        Convergence when the rmse decreases by less than tolerance. The
+        iterations go on if the rmse increases, which can happen with
+        max_distance or trim_fraction
+    max_distance : float or None
+        Pairs farther apart are rejected
+    trim_fraction : float or None
+        If given, only the trim_fraction closest pairs are kept (trimmed ICP)
+    sample : int or None
+        If given, use a fixed random subset of sample source points for the
+        iterations, which is much faster for clouds of millions of points
+    usesvd : bool
+        Kabsch (True) or Horn (False) algorithm, see superimposition_matrix
+    workers : int
+        Number of threads of the nearest neighbour search, -1 for all cores
+    tree : scipy.spatial.cKDTree or None
+        KD-tree of the target, to reuse it between calls
+    random_state : numpy.random.RandomState or None
+        Random number generator of the sample
+
+    Returns
+    -------
+    IcpResult
+
+    Examples
+    --------
+    >>> from transformations.transformations import (
+    ...     inverse_matrix, rotation_matrix, translation_matrix)
+    >>> rng = np.random.RandomState(0)
+    >>> target = rng.random_sample((2000, 3))
+    >>> m = np.dot(translation_matrix([0.01, -0.02, 0.01]),
+    ...            rotation_matrix(0.05, [1, 2, 3], [0.5, 0.5, 0.5]))
+    >>> source = transform_points(inverse_matrix(m), target)
+    >>> result = icp(source, target, tolerance=1e-12)
+    >>> result.converged, np.allclose(result.matrix, m)
+    (True, True)
+
+    With 10 percent of outliers in the source cloud, trimmed ICP on a
+    sample of the source points recovers the same matrix:
+
+    >>> source[::10] = rng.random_sample((200, 3)) + 1.0
+    >>> result = icp(source, target, tolerance=1e-12, trim_fraction=0.85,
+    ...              sample=1000, random_state=np.random.RandomState(1))
+    >>> result.converged, np.allclose(result.matrix, m)
+    (True, True)
+
+    """
+    from scipy.spatial import cKDTree
+    source = np.asarray(source, dtype=np.float64)
+    target = np.asarray(target, dtype=np.float64)
+    assert source.ndim == 2 and source.shape[1] == 3
+    assert target.ndim == 2 and target.shape[1] == 3
+    if trim_fraction is not None:
+        assert 0. < trim_fraction <= 1.
+    if tree is None:
+        tree = cKDTree(target)
+    if sample is not None and sample < source.shape[0]:
+        random_state = random_state or np.random
+        source = source[random_state.choice(source.shape[0], sample,
+                                            replace=False)]
+
+    matrix = np.identity(4) if initial is None else np.array(initial,
+                                                             dtype=float)
+    current = transform_points(matrix, source)
+    rmse = np.inf
+    inliers = 0
+    converged = False
+    iteration_times = []
+    for _ in range(max_iterations):
+        start = time.perf_counter()
+        if max_distance is None:
+            distances, indices = tree.query(current, workers=workers)
+            mask = np.ones(distances.shape, dtype=bool)
+        else:
+            # pairs beyond max_distance are not searched, their distance is inf
+            distances, indices = tree.query(current, workers=workers,
+                                            distance_upper_bound=max_distance)
+            mask = np.isfinite(distances)
+        if trim_fraction is not None:
+            n = max(int(trim_fraction * np.count_nonzero(mask)), 1)
+            kept = np.flatnonzero(mask)
+            if n < kept.size:
+                kept = kept[np.argpartition(distances[kept], n - 1)[:n]]
+            mask = np.zeros(distances.shape, dtype=bool)
+            mask[kept] = True
+        inliers = int(np.count_nonzero(mask))
+        if inliers < 3:
+            iteration_times.append(time.perf_counter() - start)
+            break
+        previous_rmse = rmse
+        rmse = float(np.sqrt(np.mean(distances[mask] ** 2)))
+        if 0.0 <= previous_rmse - rmse < tolerance:
+            iteration_times.append(time.perf_counter() - start)
+            converged = True
+            break
+        step = superimposition_matrix(current[mask].T, target[indices[mask]].T,
+                                      usesvd=usesvd)
+        matrix = np.dot(step, matrix)
+        transform_points(step, current, out=current)
+        iteration_times.append(time.perf_counter() - start)
+    return IcpResult(matrix, rmse, len(iteration_times), converged, inliers,
+                     iteration_times)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
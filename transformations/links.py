@@ -4,14 +4,51 @@ r"""Mechanical links modeling"""
 
 import numpy as np
 
+from transformations.anchors import frame_matrix
 from transformations.transformations import translation_matrix, rotation_matrix, superimposition_matrix
 
 
-def find_transformation_to_world(p, u, v):
-    v0 = np.array([(0, 0, 0), (1, 0, 0), (0, 1, 0)])
-    v1 = np.array([p, p + u, p + v])
-
-    return superimposition_matrix(v0.T, v1.T, scale=False, usesvd=False)
+def find_transformation_to_world(p, u, v, check=False):
+    r"""Transformation matrix from the frame defined by p, u, v to the world
+
+    Parameters
+    ----------
+    p : iterable
+    u : iterable
+    v : iterable
+    check : bool
+        If True, cross-check the closed form result against the point set
+        superimposition of p, p + u and p + v
+
+    Returns
+    -------
+    4x4 matrix
+
+    Raises
+    ------
+    AssertionError
+        If check is True and the results differ, also under python -O
+
+    Examples
+    --------
+    >>> m = find_transformation_to_world(np.array([1., 2., 3.]),
+    ...                                  np.array([0., 0., 1.]),
+    ...                                  np.array([1., 0., 0.]), check=True)
+    >>> np.allclose(m, [[0, 1, 0, 1], [0, 0, 1, 2], [1, 0, 0, 3],
+    ...                 [0, 0, 0, 1]])
+    True
+
+    """
+    m = frame_matrix(p, u, v)
+    if check:
+        v0 = np.array([(0, 0, 0), (1, 0, 0), (0, 1, 0)])
+        v1 = np.array([p, p + u, p + v])
+        expected = superimposition_matrix(v0.T, v1.T, scale=False,
+                                          usesvd='auto')
+        if not np.allclose(m, expected):
+            raise AssertionError('closed form matrix\n%s\ndiffers from '
+                                 'superimposition matrix\n%s' % (m, expected))
+    return m
 
 
 class Link(object):
@@ -57,3 +94,8 @@ class Link(object):
         rot_z = rotation_matrix(self.rz, self.w, self.p)
         from functools import reduce
         return reduce(np.dot, [tr, rot_x, rot_y, rot_z])
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
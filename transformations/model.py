@@ -5,12 +5,217 @@ r"""?"""
 # TODO : potential anchor names duplicates problem
 #        add_assembly should not be static and an assembly should manage a list of contained assemblies
 
+import threading
+from collections import OrderedDict, namedtuple
+
 import numpy as np
 
-from transformations.anchors import Anchor, anchor_transformation
+from transformations.anchors import Anchor, AnchorSet, anchor_transformation
 from transformations.transformations import identity_matrix
 
 
+def _transform_shape(shape, m):
+    r"""Transform an OCC shape with a 4x4 matrix
+
+    Returns
+    -------
+    a new OCC shape
+
+    """
+    from OCC.Core.gp import gp_Trsf
+    from OCC.Core.BRepBuilderAPI import BRepBuilderAPI_Transform
+    trsf = gp_Trsf()
+    trsf.SetValues(m[0, 0], m[0, 1], m[0, 2], m[0, 3],
+                   m[1, 0], m[1, 1], m[1, 2], m[1, 3],
+                   m[2, 0], m[2, 1], m[2, 2], m[2, 3])
+    transformed = BRepBuilderAPI_Transform(shape, trsf)
+    return transformed.Shape()
+
+
+# Rough memory use of the topological entities of a B-rep, in bytes
+_VERTEX_BYTES = 200
+_EDGE_BYTES = 600
+_FACE_BYTES = 2000
+
+
+def _estimate_shape_size(shape):
+    r"""Rough estimate of the memory used by an OCC shape, in bytes, from
+    the numbers of its vertices, edges and faces"""
+    from OCC.Core.TopAbs import TopAbs_VERTEX, TopAbs_EDGE, TopAbs_FACE
+    from OCC.Core.TopExp import TopExp_Explorer
+    size = 0
+    for kind, nbytes in ((TopAbs_VERTEX, _VERTEX_BYTES),
+                         (TopAbs_EDGE, _EDGE_BYTES),
+                         (TopAbs_FACE, _FACE_BYTES)):
+        explorer = TopExp_Explorer(shape, kind)
+        while explorer.More():
+            size += nbytes
+            explorer.Next()
+    return size
+
+
+ShapeCacheInfo = namedtuple('ShapeCacheInfo', ['hits',
+                                               'misses',
+                                               'evictions',
+                                               'entries',
+                                               'max_entries',
+                                               'size',
+                                               'max_size'])
+ShapeCacheInfo.__doc__ = r"""Statistics of a TransformedShapeCache
+
+size and max_size are estimated memory use in bytes
+"""
+
+
+class TransformedShapeCache(object):
+    r"""Bounded least recently used cache of transformed OCC shapes
+
+    The transformed shapes are keyed by the identity of the source shape and
+    the placement matrix rounded to a multiple of quantum, so placements
+    equal up to numerical noise share an entry. The source shapes are
+    referenced by the entries, hence their identities are not reused while
+    they are cached.
+
+    Parameters
+    ----------
+    max_entries : int
+        Maximum number of cached shapes
+    max_size : int
+        Maximum estimated memory use of the cached shapes, in bytes
+    quantum : float
+        Resolution of the placement matrix elements in the keys
+    transform : callable
+        transform(shape, m) returns the shape transformed by the 4x4 matrix m
+    estimate_size : callable
+        estimate_size(shape) returns the estimated memory use of the shape
+
+    Examples
+    --------
+    With stub callables, the cache works without OCC. Here the shape 'x'
+    translated by [n, 0, 0] is n times 'x', of size n:
+
+    >>> from transformations.transformations import translation_matrix
+    >>> cache = TransformedShapeCache(
+    ...     max_entries=2, max_size=10, quantum=1e-6,
+    ...     transform=lambda shape, m: shape * int(m[0, 3]),
+    ...     estimate_size=len)
+    >>> t = [translation_matrix([n, 0, 0]) for n in range(12)]
+    >>> shape = 'x'
+    >>> cache.transform(shape, t[3])
+    'xxx'
+    >>> cache.transform(shape, t[3] + 1e-9) is cache.transform(shape, t[3])
+    True
+    >>> tuple(cache.info())
+    (2, 1, 0, 1, 2, 3, 10)
+
+    The least recently used entries are evicted beyond max_entries, and
+    beyond max_size:
+
+    >>> cache.transform(shape, t[1]), cache.transform(shape, t[2])
+    ('x', 'xx')
+    >>> tuple(cache.info())
+    (2, 3, 1, 2, 2, 3, 10)
+    >>> cache.transform(shape, t[9])
+    'xxxxxxxxx'
+    >>> tuple(cache.info())
+    (2, 4, 3, 1, 2, 9, 10)
+
+    Shapes larger than max_size are not cached:
+
+    >>> cache.transform(shape, t[11])
+    'xxxxxxxxxxx'
+    >>> tuple(cache.info())
+    (2, 5, 3, 1, 2, 9, 10)
+    >>> cache.clear()
+    >>> tuple(cache.info()), len(cache)
+    ((0, 0, 0, 0, 2, 0, 10), 0)
+
+    """
+    def __init__(self, max_entries=256, max_size=256 * 2 ** 20,
+                 quantum=1e-9, transform=_transform_shape,
+                 estimate_size=_estimate_shape_size):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.quantum = quantum
+        self._transform = transform
+        self._estimate_size = estimate_size
+        self._entries = OrderedDict()  # key -> (source, shape, size)
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.RLock()
+
+    def key(self, shape, m):
+        r"""Cache key of the shape transformed by the 4x4 matrix m"""
+        m = np.asarray(m, dtype=float)
+        assert m.shape == (4, 4)
+        placement = np.rint(m[:3] / self.quantum).astype(np.int64)
+        return id(shape), placement.tobytes()
+
+    def transform(self, shape, m):
+        r"""The shape transformed by the 4x4 matrix m, from the cache if
+        possible
+
+        Returns
+        -------
+        an OCC shape
+
+        """
+        key = self.key(shape, m)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry[1]
+            self._misses += 1
+        transformed = self._transform(shape, m)
+        size = self._estimate_size(transformed)
+        with self._lock:
+            if size <= self.max_size and key not in self._entries:
+                self._entries[key] = (shape, transformed, size)
+                self._size += size
+                self._evict()
+        return transformed
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or
+                                 self._size > self.max_size):
+            _, (_, _, size) = self._entries.popitem(last=False)
+            self._size -= size
+            self._evictions += 1
+
+    def info(self):
+        r"""Hit, miss and eviction counts and current use of the cache
+
+        Returns
+        -------
+        ShapeCacheInfo
+
+        """
+        with self._lock:
+            return ShapeCacheInfo(self._hits, self._misses, self._evictions,
+                                  len(self._entries), self.max_entries,
+                                  self._size, self.max_size)
+
+    def clear(self):
+        r"""Remove all cached shapes and reset the statistics"""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self._hits = 0
+            self._misses = 0
+            self._evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Cache of the shapes of the parts placed in their final location
+shape_cache = TransformedShapeCache()
+
+
 class Part(object):
     r"""A Part is the simplest possible element
     
@@ -22,52 +227,123 @@ class Part(object):
     """
     def __init__(self, shape, name):
         self._shape = shape  # shape in own frame of reference
+        # (part, 4x4 matrix) whose transformed shape is the shape, computed
+        # on first access
+        self._lazy_shape = None
         self._part_transformation_matrices = []  # 4x4 matrices
+        # product of the matrices, None until first computed
+        self._combined_matrix = None
+        # bumped by every change of the transformation matrices
+        self._version = 0
         self._name = name
 
     @property
     def shape(self):
+        if self._lazy_shape is not None:
+            part, m = self._lazy_shape
+            self._shape = shape_cache.transform(part.shape, m)
+            self._lazy_shape = None
         return self._shape
 
     @property
     def name(self):
         return self._name
 
+    @property
+    def version(self):
+        r"""Counter of the changes of the transformation matrices"""
+        return self._version
+
     def add_matrix(self, m):
         r"""Add a 4x4 transformation matrix to the list of transformation
-        matrices"""
+        matrices
+
+        A copy of the matrix is stored.
+        """
         assert np.shape(m) == (4, 4)
+        m = np.array(m, dtype=float)
         self._part_transformation_matrices.append(m)
-        # self._part_transformation_matrices = [m] + self._part_transformation_matrices
+        if self._combined_matrix is not None:
+            self._set_combined_matrix(np.dot(self._combined_matrix, m))
+        self._version += 1
+
+    def prepend_matrix(self, m):
+        r"""Insert a 4x4 transformation matrix at the start of the list of
+        transformation matrices, i.e. apply it after all others
+
+        A copy of the matrix is stored.
+        """
+        assert np.shape(m) == (4, 4)
+        m = np.array(m, dtype=float)
+        self._part_transformation_matrices.insert(0, m)
+        if self._combined_matrix is not None:
+            self._set_combined_matrix(np.dot(m, self._combined_matrix))
+        self._version += 1
+
+    def _set_combined_matrix(self, m):
+        m.flags.writeable = False
+        self._combined_matrix = m
 
     @property
     def combined_matrix(self):
         r"""Combine all transformation matrices into a single matrix that
-        can be used to place the part in its final location"""
-        from functools import reduce
-        if self._part_transformation_matrices:
-            return reduce(np.dot, self._part_transformation_matrices)
-        else:
-            return identity_matrix()
+        can be used to place the part in its final location
+
+        The product is cached and updated by add_matrix and prepend_matrix.
+
+        Returns
+        -------
+        read-only 4x4 matrix
+
+        Examples
+        --------
+        The cached product is the product of the list of matrices, also if
+        the caller reuses a buffer:
+
+        >>> from functools import reduce
+        >>> from transformations.transformations import (
+        ...     random_rotation_matrix, translation_matrix)
+        >>> part = Part(None, 'part')
+        >>> buffer = np.empty((4, 4))
+        >>> m = part.combined_matrix
+        >>> translation_matrix([1, 0, 0], out=buffer)
+        >>> part.add_matrix(buffer)
+        >>> translation_matrix([0, 1, 0], out=buffer)
+        >>> part.add_matrix(buffer)
+        >>> part.prepend_matrix(random_rotation_matrix())
+        >>> part.add_matrix(random_rotation_matrix())
+        >>> buffer[:] = 0.0
+        >>> part.version
+        4
+        >>> expected = reduce(np.dot, part._part_transformation_matrices)
+        >>> np.allclose(part.combined_matrix, expected)
+        True
+        >>> part._combined_matrix = None
+        >>> np.allclose(part.combined_matrix, expected)
+        True
+        >>> part.combined_matrix.flags.writeable
+        False
+
+        """
+        if self._combined_matrix is None:
+            from functools import reduce
+            self._set_combined_matrix(
+                np.array(reduce(np.dot, self._part_transformation_matrices,
+                                identity_matrix()), dtype=float))
+        return self._combined_matrix
 
     @property
     def transformed_shape(self):
         r"""The shape of the part, placed in its final location
         
+        The transformed shapes are cached in shape_cache.
+
         Returns
         -------
         an OCC shape, in its final location
 
         """
-        from OCC.Core.gp import gp_Trsf
-        from OCC.Core.BRepBuilderAPI import BRepBuilderAPI_Transform
-        trsf = gp_Trsf()
-        m = self.combined_matrix
-        trsf.SetValues(m[0, 0], m[0, 1], m[0, 2], m[0, 3],
-                       m[1, 0], m[1, 1], m[1, 2], m[1, 3],
-                       m[2, 0], m[2, 1], m[2, 2], m[2, 3])
-        transformed = BRepBuilderAPI_Transform(self.shape, trsf)
-        return transformed.Shape()
+        return shape_cache.transform(self.shape, self.combined_matrix)
 
 
 class AnchorablePart(Part):
@@ -76,29 +352,77 @@ class AnchorablePart(Part):
     Parameters
     ----------
     shape : OCC shape
-    anchors : list of Anchors
+    anchors : AnchorSet or list of Anchors
+        If anchors of the list have the same name, the last one is kept
+
+    Examples
+    --------
+    >>> part = AnchorablePart(None, 'part', [
+    ...     Anchor([0, 0, 0], [1, 0, 0], [0, 1, 0], 'a'),
+    ...     Anchor([1, 1, 1], [0, 0, 1], [1, 0, 0], 'a')])
+    >>> len(part.anchors), tuple(part.anchors['a'].p)
+    (1, (1.0, 1.0, 1.0))
 
     """
     def __init__(self, shape, name, anchors):
         super().__init__(shape, name)
-        self._anchors = {anchor.name: anchor for anchor in anchors}
+        if not isinstance(anchors, AnchorSet):
+            anchors = AnchorSet({anchor.name: anchor
+                                 for anchor in anchors}.values())
+        self._anchors = anchors
 
     @property
     def anchors(self):
+        r"""AnchorSet, a mapping of anchor names to Anchors"""
         return self._anchors
 
+    @property
+    def world_anchors(self):
+        r"""The anchors of the part, placed in its final location
+
+        The shape is not transformed.
+
+        Returns
+        -------
+        AnchorSet
+
+        """
+        return self.anchors.transform(self.combined_matrix)
+
     @property
     def transformed(self):
         r"""
         
         Returns
         -------
-        A new AnchorablePart, placed in its final location
+        A new AnchorablePart, placed in its final location. Its shape is
+        transformed on first access, with the current combined matrix.
+
+        Examples
+        --------
+        The anchors are placed with the matrix at call time, later matrices
+        only affect the part itself:
+
+        >>> from transformations.transformations import translation_matrix
+        >>> part = AnchorablePart(None, 'part', [
+        ...     Anchor([0, 0, 0], [1, 0, 0], [0, 1, 0], 'a')])
+        >>> part.add_matrix(translation_matrix([1, 2, 3]))
+        >>> placed = part.transformed
+        >>> part.add_matrix(translation_matrix([1, 0, 0]))
+        >>> tuple(placed.anchors['a'].p), tuple(part.world_anchors['a'].p)
+        ((1.0, 2.0, 3.0), (2.0, 2.0, 3.0))
+        >>> np.allclose(placed._lazy_shape[1], translation_matrix([1, 2, 3]))
+        True
+        >>> all(np.allclose(part.world_anchors[name].data,
+        ...                 anchor.transform(part.combined_matrix).data)
+        ...     for name, anchor in part.anchors.items())
+        True
 
         """
-        transformed_shape = self.transformed_shape
-        transformed_anchors = [a.transform(self.combined_matrix) for a in self.anchors.values()]
-        return AnchorablePart(transformed_shape, self.name, transformed_anchors)
+        m = self.combined_matrix
+        part = AnchorablePart(None, self.name, self.anchors.transform(m))
+        part._lazy_shape = (self, m)
+        return part
 
 
 class Assembly(object):
@@ -143,8 +467,8 @@ class Assembly(object):
         assert len(part_to_add_anchors) == len(receiving_parts) == len(receiving_parts_anchors) == len(links)
         if len(part_to_add_anchors) == 1:
             # This is the base case that is already dealt with in osvcad
-            m = anchor_transformation(part_to_add.transformed.anchors[part_to_add_anchors[0]],
-                                      receiving_parts[0].transformed.anchors[receiving_parts_anchors[0]])
+            m = anchor_transformation(part_to_add.world_anchors[part_to_add_anchors[0]],
+                                      receiving_parts[0].world_anchors[receiving_parts_anchors[0]])
             part_to_add.add_matrix(m)
             part_to_add.add_matrix(links[0].transformation_matrix)
             self._parts.append(part_to_add)
@@ -164,11 +488,10 @@ class Assembly(object):
         if len(assembly_to_add_anchors) == 1:
             m = anchor_transformation(assembly_to_add.anchors[assembly_to_add_anchors[0]],
                                       receiving_assemblies[0].anchors[receiving_assemblies_anchors[0]])
+            link_matrix = links[0].transformation_matrix
             for part in assembly_to_add._parts:
-                # part.add_matrix(m)
-                part._part_transformation_matrices = [m] + part._part_transformation_matrices
-                # part.add_matrix(links[0].transformation_matrix)
-                part._part_transformation_matrices = [links[0].transformation_matrix] + part._part_transformation_matrices
+                part.prepend_matrix(m)
+                part.prepend_matrix(link_matrix)
         else:
             raise NotImplementedError
 
@@ -176,6 +499,11 @@ class Assembly(object):
     def anchors(self):
         anchors = {}
         for part in self._parts:
-            for k, v in part.transformed.anchors.items():
+            for k, v in part.world_anchors.items():
                 anchors[k] = v
         return anchors
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,242 @@
+# coding: utf-8
+
+r"""Multi-threaded application of transformations to large point arrays
+
+NumPy releases the GIL in its matrix products, so the chunks of a large
+array can be transformed concurrently by a pool of threads.
+
+Scaling benchmark, from 1 worker up to all available cores::
+
+    python -m transformations.parallel
+
+The doctests are run with::
+
+    python -c "import doctest, transformations.parallel as m; doctest.testmod(m)"
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from transformations.points import transform_points, transform_vectors, \
+    DEFAULT_CHUNK_SIZE, _result_dtype
+
+# Default memory budget for the (K, N, 3) outputs allocated by
+# parallel_transform_points_many, in bytes
+DEFAULT_MEMORY_BUDGET = 2 ** 30
+
+
+def default_workers():
+    r"""Number of available cores"""
+    return os.cpu_count() or 1
+
+
+def _chunks(n, chunk_size):
+    return [slice(start, start + chunk_size)
+            for start in range(0, n, chunk_size)]
+
+
+def parallel_transform_points(m, points, out=None, workers=None,
+                              chunk_size=DEFAULT_CHUNK_SIZE, vectors=False,
+                              dtype=None):
+    r"""Transform (N, 3) points with a 4x4 matrix using a pool of threads
+
+    Parameters
+    ----------
+    m : 4x4 matrix or Transform
+    points : array of shape (N, 3)
+    out : array of shape (N, 3) or None
+        May be points itself for an in-place transformation
+    workers : int or None
+        Number of threads, all available cores if None
+    chunk_size : int
+        Number of points transformed by a thread at once
+    vectors : bool
+        If True, transform direction vectors (the translation is ignored)
+    dtype : numpy dtype or None
+        Precision of the computation and of the result if out is None,
+        see transform_points
+
+    Returns
+    -------
+    The transformed points (out if given)
+
+    Examples
+    --------
+    >>> from transformations.transformations import random_rotation_matrix
+    >>> m = random_rotation_matrix()
+    >>> m[:3, 3] = [1, 2, 3]
+    >>> points = np.random.random_sample((1000, 3))
+    >>> np.allclose(parallel_transform_points(m, points, workers=4,
+    ...                                       chunk_size=99),
+    ...             transform_points(m, points))
+    True
+    >>> np.allclose(parallel_transform_points(m, points, workers=4,
+    ...                                       chunk_size=99, vectors=True),
+    ...             transform_vectors(m, points))
+    True
+
+    """
+    points = np.asarray(points)
+    assert points.ndim == 2 and points.shape[1] == 3, "expected (N, 3) array"
+    dtype = _result_dtype(points, dtype)
+    if out is None:
+        out = np.empty(points.shape, dtype=dtype)
+    assert out.shape == points.shape
+    transform = transform_vectors if vectors else transform_points
+    workers = workers or default_workers()
+
+    def work(chunk):
+        transform(m, points[chunk], out=out[chunk], chunk_size=chunk_size,
+                  dtype=dtype)
+
+    chunks = _chunks(points.shape[0], chunk_size)
+    if workers == 1 or len(chunks) == 1:
+        for chunk in chunks:
+            work(chunk)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(work, chunks))
+    return out
+
+
+def parallel_transform_points_many(matrices, points, out=None, workers=None,
+                                   chunk_size=DEFAULT_CHUNK_SIZE,
+                                   vectors=False,
+                                   memory_budget=DEFAULT_MEMORY_BUDGET,
+                                   dtype=None):
+    r"""Transform (N, 3) points with each of K 4x4 matrices
+
+    The K x N work is split in (matrix, chunk of points) tasks executed by a
+    pool of threads.
+
+    Parameters
+    ----------
+    matrices : array of shape (K, 4, 4) or list of Transforms
+    points : array of shape (N, 3)
+    out : array of shape (K, N, 3) or None
+        An output that does not fit in memory can be a numpy.memmap
+    workers : int or None
+        Number of threads, all available cores if None
+    chunk_size : int
+        Number of points transformed by a task
+    vectors : bool
+        If True, transform direction vectors (the translation is ignored)
+    memory_budget : int
+        Maximum size in bytes of the output allocated when out is None
+    dtype : numpy dtype or None
+        Precision of the computation and of the result if out is None,
+        see transform_points
+
+    Returns
+    -------
+    The transformed points, shape (K, N, 3) (out if given)
+
+    Raises
+    ------
+    MemoryError if out is None and the output exceeds memory_budget
+
+    Examples
+    --------
+    >>> from transformations.transform import Transform
+    >>> from transformations.transformations import random_rotation_matrix
+    >>> matrices = [random_rotation_matrix() for _ in range(3)]
+    >>> matrices[0][:3, 3] = [1, 2, 3]
+    >>> matrices[1] = Transform(matrices[1])
+    >>> points = np.random.random_sample((1000, 3))
+    >>> out = parallel_transform_points_many(matrices, points, workers=4,
+    ...                                      chunk_size=99)
+    >>> out.shape
+    (3, 1000, 3)
+    >>> all(np.allclose(out[k], transform_points(m, points))
+    ...     for k, m in enumerate(matrices))
+    True
+    >>> out = parallel_transform_points_many(matrices, points, workers=4,
+    ...                                      chunk_size=99, vectors=True)
+    >>> all(np.allclose(out[k], transform_vectors(m, points))
+    ...     for k, m in enumerate(matrices))
+    True
+    >>> parallel_transform_points_many(matrices, points, memory_budget=10000)
+    ... # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+     ...
+    MemoryError: output of 72000 bytes exceeds the memory budget of 10000 ...
+
+    """
+    matrices = [np.asarray(m) for m in matrices]
+    points = np.asarray(points)
+    assert points.ndim == 2 and points.shape[1] == 3, "expected (N, 3) array"
+    shape = (len(matrices), ) + points.shape
+    dtype = _result_dtype(points, dtype)
+    if out is None:
+        size = int(np.prod(shape)) * dtype.itemsize
+        if size > memory_budget:
+            raise MemoryError("output of %i bytes exceeds the memory budget "
+                              "of %i bytes, pass a memory-mapped out array"
+                              % (size, memory_budget))
+        out = np.empty(shape, dtype=dtype)
+    assert out.shape == shape
+    transform = transform_vectors if vectors else transform_points
+    workers = workers or default_workers()
+
+    def work(task):
+        k, chunk = task
+        transform(matrices[k], points[chunk], out=out[k, chunk],
+                  chunk_size=chunk_size, dtype=dtype)
+
+    tasks = [(k, chunk) for k in range(len(matrices))
+             for chunk in _chunks(points.shape[0], chunk_size)]
+    if workers == 1 or len(tasks) == 1:
+        for task in tasks:
+            work(task)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(work, tasks))
+    return out
+
+
+def benchmark(n=10000000, k=1, dtype=np.float64,
+              chunk_size=DEFAULT_CHUNK_SIZE, repeat=3, max_workers=None):
+    r"""Time the transformation of n points by k matrices with 1 worker up to
+    max_workers workers
+
+    Returns
+    -------
+    list of (workers, best time in seconds, speedup) tuples
+
+    """
+    from transformations.transformations import random_rotation_matrix
+    points = np.random.rand(n, 3).astype(dtype)
+    matrices = [random_rotation_matrix() for _ in range(k)]
+    out = np.empty((k, n, 3), dtype=dtype)
+    results = []
+    for workers in range(1, (max_workers or default_workers()) + 1):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            parallel_transform_points_many(matrices, points, out=out,
+                                           workers=workers,
+                                           chunk_size=chunk_size)
+            best = min(best, time.perf_counter() - start)
+        results.append((workers, best, results[0][1] / best if results
+                        else 1.0))
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Thread scaling benchmark")
+    parser.add_argument('-n', type=int, default=10000000, help="points")
+    parser.add_argument('-k', type=int, default=1, help="matrices")
+    parser.add_argument('--dtype', default='float64',
+                        choices=('float32', 'float64'))
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args()
+    print("%i points x %i matrices, %s, chunks of %i points"
+          % (args.n, args.k, args.dtype, args.chunk_size))
+    print("workers   time (s)   speedup")
+    for workers, t, speedup in benchmark(args.n, args.k, np.dtype(args.dtype),
+                                         args.chunk_size):
+        print("%7i %10.4f %9.2f" % (workers, t, speedup))
@@ -0,0 +1,216 @@
+# coding: utf-8
+
+r"""Apply 4x4 transformation matrices to arrays of 3D points and vectors
+
+Points and vectors are (N, 3) arrays. The transformations are computed as
+R.x + t, without building homogeneous coordinates, in chunks of rows so that
+the temporaries stay small and in cache. float32 and float64 arrays are
+transformed in their own precision, other arrays in the precision of the
+transformations module (see transformations.set_precision) unless a dtype
+is given.
+"""
+
+import numpy as np
+
+from transformations.transformations import get_precision
+
+# Number of rows transformed at once
+DEFAULT_CHUNK_SIZE = 65536
+
+
+def _check_shape(a):
+    assert a.ndim in (1, 2) and a.shape[-1] == 3, "expected (N, 3) array"
+
+
+def _result_dtype(a, dtype=None):
+    if dtype is not None:
+        return np.dtype(dtype)
+    if a.dtype in (np.float32, np.float64):
+        return a.dtype
+    return get_precision()
+
+
+def _prepare(m, a, out, dtype=None):
+    r"""Check the arguments and cast the matrix to the working dtype
+
+    Returns
+    -------
+    tuple : (m, a, o, out) where a and o are 2D views of the input and output
+    """
+    a = np.asarray(a)
+    _check_shape(a)
+    dtype = _result_dtype(a, dtype)
+    m = np.asarray(m, dtype=dtype)
+    assert m.shape == (4, 4)
+    if out is None:
+        out = np.empty(a.shape, dtype=dtype)
+    else:
+        assert out.shape == a.shape, "out must have the shape of the input"
+    return m, a.reshape(-1, 3), out.reshape(-1, 3), out
+
+
+def transform_points(m, points, out=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                     dtype=None):
+    r"""Transform points with a 4x4 matrix
+
+    Parameters
+    ----------
+    m : 4x4 matrix or Transform
+    points : array of shape (N, 3) or (3,)
+    out : array of the same shape as points or None
+        Array to store the result into. May be points itself for an in-place
+        transformation.
+    chunk_size : int
+        Number of points transformed at once
+    dtype : numpy dtype or None
+        Precision of the computation and of the result if out is None
+
+    Returns
+    -------
+    The transformed points (out if given)
+
+    Examples
+    --------
+    The result is the homogeneous product, also for perspective matrices:
+
+    >>> from transformations.transformations import (
+    ...     precision, projection_matrix, random_rotation_matrix)
+    >>> rng = np.random.RandomState(0)
+    >>> m = random_rotation_matrix(rng.random_sample(3))
+    >>> m[:3, 3] = [1, 2, 3]
+    >>> p = projection_matrix([0, 0, 10], [0, 0, 1], perspective=[0, 0, 20])
+    >>> points = rng.random_sample((10, 3))
+    >>> h = np.hstack((points, np.ones((10, 1))))
+    >>> def expected(m):
+    ...     e = np.dot(h, np.asarray(m).T)
+    ...     return e[:, :3] / e[:, 3:]
+    >>> np.allclose(transform_points(m, points), expected(m))
+    True
+    >>> np.allclose(transform_points(p, points), expected(p))
+    True
+    >>> np.allclose(transform_points(p, points, chunk_size=3), expected(p))
+    True
+    >>> np.allclose(transform_points(m, points[0]), expected(m)[0])
+    True
+
+    Transforms are accepted, and out may be the points themselves:
+
+    >>> from transformations.transform import Transform
+    >>> np.allclose(transform_points(Transform(m), points), expected(m))
+    True
+    >>> a = points.copy()
+    >>> transform_points(m, a, out=a) is a
+    True
+    >>> np.allclose(a, expected(m))
+    True
+
+    float32 points stay float32, other types follow the module precision:
+
+    >>> transform_points(m, points.astype(np.float32)).dtype
+    dtype('float32')
+    >>> with precision(np.float32):
+    ...     transform_points(m, [[1, 2, 3]]).dtype
+    dtype('float32')
+    >>> transform_points(m, [[1, 2, 3]]).dtype
+    dtype('float64')
+
+    """
+    m, a, o, out = _prepare(m, points, out, dtype)
+    r = m[:3, :3].T
+    t = m[:3, 3]
+    perspective = not np.array_equal(m[3], (0, 0, 0, 1))
+    for start in range(0, a.shape[0], chunk_size):
+        chunk = slice(start, start + chunk_size)
+        tmp = np.dot(a[chunk], r)
+        tmp += t
+        if perspective:
+            w = np.dot(a[chunk], m[3, :3]) + m[3, 3]
+            tmp /= w[:, np.newaxis]
+        o[chunk] = tmp
+    return out
+
+
+def transform_vectors(m, vectors, out=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                      dtype=None):
+    r"""Transform direction vectors with the linear part of a 4x4 matrix
+
+    The translation and the perspective partition of m are ignored.
+
+    Parameters
+    ----------
+    m : 4x4 matrix or Transform
+    vectors : array of shape (N, 3) or (3,)
+    out : array of the same shape as vectors or None
+        Array to store the result into. May be vectors itself for an in-place
+        transformation.
+    chunk_size : int
+        Number of vectors transformed at once
+    dtype : numpy dtype or None
+        Precision of the computation and of the result if out is None
+
+    Returns
+    -------
+    The transformed vectors (out if given)
+
+    Examples
+    --------
+    >>> from transformations.transformations import random_rotation_matrix
+    >>> m = random_rotation_matrix()
+    >>> m[:3, 3] = [1, 2, 3]
+    >>> vectors = np.random.random_sample((10, 3))
+    >>> h = np.hstack((vectors, np.zeros((10, 1))))
+    >>> np.allclose(transform_vectors(m, vectors, chunk_size=3),
+    ...             np.dot(h, m.T)[:, :3])
+    True
+    >>> np.allclose(transform_vectors(m, vectors[0]), np.dot(m[:3, :3],
+    ...                                                       vectors[0]))
+    True
+
+    """
+    m, a, o, out = _prepare(m, vectors, out, dtype)
+    r = m[:3, :3].T
+    for start in range(0, a.shape[0], chunk_size):
+        chunk = slice(start, start + chunk_size)
+        o[chunk] = np.dot(a[chunk], r)
+    return out
+
+
+def transform_points_rigid(rotation, translation, points, out=None,
+                           chunk_size=DEFAULT_CHUNK_SIZE, dtype=None):
+    r"""Transform points with a rotation matrix and a translation vector
+
+    Parameters
+    ----------
+    rotation : 3x3 matrix
+    translation : iterable of 3 numbers
+    points : array of shape (N, 3) or (3,)
+    out : array of the same shape as points or None
+    chunk_size : int
+    dtype : numpy dtype or None
+
+    Returns
+    -------
+    The transformed points (out if given)
+
+    Examples
+    --------
+    >>> from transformations.transformations import random_rotation_matrix
+    >>> m = random_rotation_matrix()
+    >>> m[:3, 3] = [1, 2, 3]
+    >>> points = np.random.random_sample((10, 3))
+    >>> h = np.hstack((points, np.ones((10, 1))))
+    >>> np.allclose(transform_points_rigid(m[:3, :3], m[:3, 3], points),
+    ...             np.dot(h, m.T)[:, :3])
+    True
+
+    """
+    m = np.identity(4)
+    m[:3, :3] = rotation
+    m[:3, 3] = translation
+    return transform_points(m, points, out=out, chunk_size=chunk_size,
+                            dtype=dtype)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,223 @@
+# coding: utf-8
+
+r"""RANSAC registration of point sets with outlier correspondences
+
+Minimal samples are drawn in bulk, solved as a stack of hypotheses with
+superimposition_matrix_batch (or a stacked linear solve for affine
+transformations) and scored against all correspondences in one vectorized
+pass per batch of hypotheses.
+"""
+
+import math
+
+import numpy as np
+
+from transformations.transformations import superimposition_matrix, \
+    superimposition_matrix_batch, affine_matrix_from_points
+
+MODELS = ('rigid', 'similarity', 'affine')
+
+# Maximum number of elements of the (K, 3, n) temporaries of the scoring
+_SCORE_BUDGET = 2 ** 22
+
+
+def _sample_size(model):
+    return 4 if model == 'affine' else 3
+
+
+def _hypotheses(v0, v1, samples, model):
+    r"""Stack of (K, 4, 4) matrices solving the minimal samples
+
+    Parameters
+    ----------
+    v0 : array of shape (3, N)
+    v1 : array of shape (3, N)
+    samples : int array of shape (K, sample size)
+    model : str
+
+    """
+    s0 = np.moveaxis(v0[:, samples], 0, 1)  # (K, 3, sample size)
+    s1 = np.moveaxis(v1[:, samples], 0, 1)
+    if model != 'affine':
+        return superimposition_matrix_batch(s0, s1,
+                                            scale=(model == 'similarity'))
+    # 4 correspondences determine the affine matrix: solve [s0; 1].T m.T = s1.T
+    a = np.ones((samples.shape[0], 4, 4))
+    a[:, :, :3] = np.swapaxes(s0, 1, 2)
+    b = np.swapaxes(s1, 1, 2)
+    regular = np.abs(np.linalg.det(a)) > 1e-12
+    m = np.zeros((samples.shape[0], 4, 4))
+    m[:, 3, 3] = 1.0
+    m[regular, :3, :] = np.swapaxes(np.linalg.solve(a[regular], b[regular]),
+                                    1, 2)
+    # degenerate samples are given a matrix that scores no inliers
+    m[~regular, :3, 3] = np.inf
+    return m
+
+
+def _residuals(m, v0, v1):
+    r"""(K, N) distances between the transformed v0 points and the v1 points"""
+    d = np.matmul(m[:, :3, :3], v0) + m[:, :3, 3:] - v1
+    d *= d
+    return np.sqrt(np.sum(d, axis=1))
+
+
+def _score(m, v0, v1, threshold):
+    r"""Numbers of inliers and sums of inlier residuals of (K, 4, 4)
+    hypotheses
+
+    The correspondences are scored in slices, so that the temporaries hold
+    at most about _SCORE_BUDGET elements whatever their number.
+
+    Returns
+    -------
+    tuple : (int array of shape (K,), float array of shape (K,))
+
+    """
+    k, n = m.shape[0], v0.shape[1]
+    step = max(1, _SCORE_BUDGET // (3 * k))
+    counts = np.zeros(k, dtype=np.intp)
+    errors = np.zeros(k)
+    for start in range(0, n, step):
+        chunk = slice(start, start + step)
+        residuals = _residuals(m, v0[:, chunk], v1[:, chunk])
+        inliers = residuals < threshold
+        counts += np.sum(inliers, axis=1)
+        errors += np.sum(np.where(inliers, residuals, 0.0), axis=1)
+    return counts, errors
+
+
+def ransac_matrix(v0, v1, threshold, model='rigid', confidence=0.999,
+                  max_iterations=10000, batch_size=256, refine=True,
+                  random_state=None):
+    r"""Robust matrix transforming the v0 points into the v1 points
+
+    Parameters
+    ----------
+    v0 : array of shape (3, N) or (4, N)
+    v1 : array of shape (3, N) or (4, N)
+        Correspondences, possibly with outliers
+    threshold : float
+        Maximum distance between a transformed v0 point and its v1 point for
+        the correspondence to be an inlier
+    model : str
+        'rigid', 'similarity' or 'affine'
+    confidence : float
+        Probability of having drawn at least one outlier free sample when the
+        iterations stop early
+    max_iterations : int
+        Maximum number of hypotheses
+    batch_size : int
+        Number of hypotheses solved and scored at once
+    refine : bool
+        If True, the matrix is refined by a least squares fit on the inliers
+    random_state : numpy.random.RandomState or None
+
+    Returns
+    -------
+    tuple : (4x4 matrix, boolean inlier mask of shape (N,))
+
+    Raises
+    ------
+    ValueError
+        If no hypothesis has any inlier, e.g. because all samples are
+        degenerate (coplanar points for the affine model, duplicated points
+        for the similarity model)
+
+    Examples
+    --------
+    >>> from transformations.transformations import (
+    ...     concatenate_matrices, random_rotation_matrix, scale_matrix,
+    ...     translation_matrix)
+    >>> rng = np.random.RandomState(0)
+    >>> t = translation_matrix([1, 2, 3])
+    >>> r = random_rotation_matrix(rng.random_sample(3))
+    >>> a = np.identity(4)
+    >>> a[:3] += rng.random_sample((3, 4)) - 0.5
+    >>> matrices = {'rigid': concatenate_matrices(t, r),
+    ...             'similarity': concatenate_matrices(t, r, scale_matrix(2)),
+    ...             'affine': a}
+    >>> v0 = rng.random_sample((3, 100)) * 10
+    >>> outliers = rng.random_sample(100) < 0.3
+    >>> for model, m in sorted(matrices.items()):
+    ...     v1 = np.dot(m[:3, :3], v0) + m[:3, 3:]
+    ...     v1[:, outliers] = rng.random_sample((3, 100))[:, outliers] * 10
+    ...     matrix, inliers = ransac_matrix(v0, v1, 0.01, model,
+    ...                                     random_state=rng)
+    ...     print(model, np.allclose(matrix, m),
+    ...           np.array_equal(inliers, ~outliers))
+    affine True True
+    rigid True True
+    similarity True True
+
+    Affine matrices are not determined by coplanar points, nor similarity
+    matrices by duplicated points:
+
+    >>> v0[2] = 0.0
+    >>> ransac_matrix(v0, v0, 0.01, 'affine', random_state=rng)
+    Traceback (most recent call last):
+     ...
+    ValueError: no hypothesis has inliers
+    >>> ransac_matrix(np.ones((3, 100)), v0, 0.01, 'similarity',
+    ...               random_state=rng)
+    Traceback (most recent call last):
+     ...
+    ValueError: no hypothesis has inliers
+
+    """
+    if model not in MODELS:
+        raise ValueError('unknown model %s' % model)
+    v0 = np.asarray(v0, dtype=np.float64)[:3]
+    v1 = np.asarray(v1, dtype=np.float64)[:3]
+    if v0.shape != v1.shape or v0.shape[0] != 3:
+        raise ValueError('input arrays are of wrong shape or type')
+    n = v0.shape[1]
+    size = _sample_size(model)
+    if n < size:
+        raise ValueError('not enough correspondences')
+    random_state = random_state or np.random
+
+    best_count = -1
+    best_error = np.inf
+    best_matrix = None
+    required = max_iterations
+    iterations = 0
+    while iterations < min(required, max_iterations):
+        k = min(batch_size, max_iterations - iterations)
+        # minimal samples, of distinct indices for small sets; duplicates in
+        # large sets are rare and only yield hypotheses with poor scores
+        samples = np.argsort(random_state.rand(k, n), axis=1)[:, :size] \
+            if n <= 64 else random_state.randint(0, n, (k, size))
+        m = _hypotheses(v0, v1, samples, model)
+        counts, errors = _score(m, v0, v1, threshold)
+        # most inliers, then smallest inlier residuals
+        i = np.lexsort((errors, -counts))[0]
+        if counts[i] > best_count or (counts[i] == best_count and
+                                      errors[i] < best_error):
+            best_count, best_error, best_matrix = counts[i], errors[i], m[i]
+            # adaptive number of iterations
+            p = (best_count / float(n)) ** size
+            if p >= 1.0:
+                required = 0
+            elif 1.0 - p < 1.0:
+                required = math.log(1.0 - confidence) / math.log(1.0 - p)
+        iterations += k
+    if best_count <= 0:
+        # also excludes the matrices of degenerate samples
+        raise ValueError('no hypothesis has inliers')
+
+    inliers = _residuals(best_matrix[np.newaxis], v0, v1)[0] < threshold
+    if refine and np.count_nonzero(inliers) >= size:
+        if model == 'affine':
+            best_matrix = affine_matrix_from_points(v0[:, inliers],
+                                                    v1[:, inliers])
+        else:
+            best_matrix = superimposition_matrix(
+                v0[:, inliers], v1[:, inliers], scale=(model == 'similarity'))
+        inliers = _residuals(best_matrix[np.newaxis], v0, v1)[0] < threshold
+    return best_matrix, inliers
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,399 @@
+# coding: utf-8
+
+r"""Registration of point sets too large to be held in memory
+
+The point sets are fed chunk by chunk. Only the weight sum, the centroids
+and the second moments about the centroids are kept, merged chunk after
+chunk with the pairwise update of Chan et al., so memory use does not depend
+on the number of points and the result does not suffer from the cancellation
+of raw sums of large coordinates.
+"""
+
+import math
+
+import numpy as np
+
+from transformations.transformations import quaternion_matrix
+
+
+def rotation_from_covariance(c, usesvd=True):
+    r"""Rotation matrix that best maps centered points v0 on centered points v1
+
+    Parameters
+    ----------
+    c : 3x3 matrix
+        Cross-covariance sum(v1 . v0.T) of the centered point sets
+    usesvd : bool
+        If True, use the SVD based algorithm by Kabsch, otherwise the
+        quaternion based algorithm by Horn, as in affine_matrix_from_points
+
+    Returns
+    -------
+    3x3 matrix
+
+    """
+    if usesvd:
+        u, s, vh = np.linalg.svd(c)
+        r = np.dot(u, vh)
+        if np.linalg.det(r) < 0.0:
+            # r does not constitute right handed system
+            r -= np.outer(u[:, 2], vh[2, :] * 2.0)
+        return r
+    # c[i, j] is sum(v1[i] * v0[j])
+    xx, yy, zz = c[0, 0], c[1, 1], c[2, 2]
+    xy, yz, zx = c[1, 0], c[2, 1], c[0, 2]
+    xz, yx, zy = c[2, 0], c[0, 1], c[1, 2]
+    n = [[xx+yy+zz, 0.0,      0.0,      0.0],
+         [yz-zy,    xx-yy-zz, 0.0,      0.0],
+         [zx-xz,    xy+yx,    yy-xx-zz, 0.0],
+         [xy-yx,    zx+xz,    yz+zy,    zz-xx-yy]]
+    # quaternion: eigenvector corresponding to most positive eigenvalue
+    w, v = np.linalg.eigh(n)
+    q = v[:, np.argmax(w)]
+    return quaternion_matrix(q)[:3, :3]
+
+
+class _Moments(object):
+    r"""Weight sum, mean and scatter matrix of k-dimensional samples,
+    accumulated chunk by chunk"""
+    def __init__(self):
+        self.weight = 0.0
+        self.mean = None
+        self.scatter = None  # sum w (x - mean)(x - mean).T
+
+    def add(self, x, weights=None):
+        r"""Add samples x of shape (k, N), with optional weights of shape
+        (N,)"""
+        if x.shape[1] == 0:
+            return
+        if weights is None:
+            weight = float(x.shape[1])
+            mean = np.mean(x, axis=1)
+            d = x - mean[:, np.newaxis]
+            wd = d
+        else:
+            weights = np.asarray(weights, dtype=np.float64)
+            if weights.shape != (x.shape[1], ):
+                raise ValueError('weights are of wrong shape')
+            weight = float(np.sum(weights))
+            if weight <= 0.0:
+                return
+            mean = np.dot(x, weights) / weight
+            d = x - mean[:, np.newaxis]
+            wd = d * weights
+        self._merge(weight, mean, np.dot(wd, d.T))
+
+    def update(self, other):
+        r"""Merge the moments of other samples"""
+        if other.weight > 0.0:
+            self._merge(other.weight, other.mean, other.scatter)
+
+    def _merge(self, weight, mean, scatter):
+        if self.mean is None:
+            self.weight = weight
+            self.mean = mean.copy()
+            self.scatter = scatter.copy()
+            return
+        if mean.shape != self.mean.shape:
+            raise ValueError('samples are of wrong dimension')
+        total = self.weight + weight
+        delta = mean - self.mean
+        self.scatter += scatter + (self.weight * weight / total) * \
+            np.outer(delta, delta)
+        self.mean += delta * (weight / total)
+        self.weight = total
+
+
+def _stack(v0, v1, ndims=None):
+    r"""Check corresponding point sets and stack them in a (2 ndims, N)
+    array"""
+    v0 = np.asarray(v0, dtype=np.float64)[:ndims]
+    v1 = np.asarray(v1, dtype=np.float64)[:ndims]
+    if v0.ndim != 2 or v0.shape != v1.shape or v0.shape[0] < 2:
+        raise ValueError('input arrays are of wrong shape or type')
+    return np.concatenate((v0, v1), axis=0)
+
+
+class IncrementalRegistrar(object):
+    r"""Accumulates corresponding point sets chunk by chunk and finalizes to
+    the superimposition matrix of the whole sets
+
+    Parameters
+    ----------
+    scale : bool
+        If True, compute a similarity instead of a rigid transformation
+    usesvd : bool
+        Kabsch (True) or Horn (False) algorithm
+
+    Examples
+    --------
+    Registrars of parts of the point sets are merged with update:
+
+    >>> from transformations.transformations import superimposition_matrix
+    >>> rng = np.random.RandomState(0)
+    >>> v0 = rng.random_sample((3, 1000)) * 100 + 1000
+    >>> v1 = v0[::-1] + rng.normal(0, 0.5, v0.shape)
+    >>> registrars = [IncrementalRegistrar(scale=True) for _ in range(2)]
+    >>> for i in range(0, 1000, 100):
+    ...     registrars[i % 200 // 100].add(v0[:, i:i+100], v1[:, i:i+100])
+    >>> registrars[0].update(registrars[1])
+    >>> registrars[0].weight
+    1000.0
+    >>> np.allclose(registrars[0].matrix(),
+    ...             superimposition_matrix(v0, v1, scale=True))
+    True
+
+    """
+    def __init__(self, scale=False, usesvd=True):
+        self.scale = scale
+        self.usesvd = usesvd
+        self._moments = _Moments()
+
+    @property
+    def weight(self):
+        r"""Sum of the weights of the points added so far (their number if
+        no weights were given)"""
+        return self._moments.weight
+
+    @property
+    def centroids(self):
+        r"""Weighted centroids of both point sets"""
+        return self._moments.mean[:3].copy(), self._moments.mean[3:].copy()
+
+    @property
+    def covariance(self):
+        r"""Weighted cross-covariance sum(w (v1 - m1)(v0 - m0).T)"""
+        return self._moments.scatter[3:, :3].copy()
+
+    def add(self, v0, v1, weights=None):
+        r"""Add a chunk of corresponding points
+
+        Parameters
+        ----------
+        v0 : array of shape (3, N) or (4, N)
+        v1 : array of shape (3, N) or (4, N)
+        weights : array of shape (N,) or None
+
+        """
+        x = _stack(v0, v1, 3)
+        if x.shape[0] != 6:
+            raise ValueError('input arrays are of wrong shape or type')
+        self._moments.add(x, weights)
+
+    def update(self, other):
+        r"""Merge the accumulators of another IncrementalRegistrar, e.g. one
+        that processed other chunks in another thread"""
+        self._moments.update(other._moments)
+
+    def matrix(self):
+        r"""Superimposition matrix of the points added so far
+
+        Returns
+        -------
+        4x4 matrix transforming v0 points into v1 points
+
+        """
+        if self.weight == 0.0:
+            raise ValueError('no points were added')
+        scatter = self._moments.scatter
+        r = rotation_from_covariance(scatter[3:, :3], self.usesvd)
+        if self.scale:
+            # scale is ratio of RMS deviations from centroid
+            r = r * math.sqrt(np.trace(scatter[3:, 3:]) /
+                              np.trace(scatter[:3, :3]))
+        mean_0, mean_1 = self.centroids
+        m = np.identity(4)
+        m[:3, :3] = r
+        m[:3, 3] = mean_1 - np.dot(r, mean_0)
+        return m
+
+
+class IncrementalAffineRegistrar(object):
+    r"""Accumulates corresponding point sets chunk by chunk and finalizes to
+    the general affine matrix of affine_matrix_from_points(shear=True)
+
+    Only the (2 ndims, 2 ndims) scatter matrix of the stacked point sets is
+    kept, instead of the (2 ndims, N) concatenation whose SVD is computed by
+    affine_matrix_from_points.
+
+    Parameters
+    ----------
+    method : str
+        'svd' : algorithm by Hartley and Zissermann, as in
+                affine_matrix_from_points. The right singular vectors of the
+                concatenated centered point sets are the eigenvectors of their
+                scatter matrix. Errors are assumed in both point sets.
+        'lstsq' : least squares solution of the normal equations, errors
+                  are assumed in v1 only. Same result for exact
+                  correspondences. If v0 is noisy too, the result differs
+                  from affine_matrix_from_points: the linear part is biased
+                  toward zero (regression dilution).
+
+    Examples
+    --------
+    >>> from transformations.transformations import affine_matrix_from_points
+    >>> rng = np.random.RandomState(2)
+    >>> m = np.identity(4)
+    >>> m[:3] += rng.random_sample((3, 4)) - 0.5
+    >>> v0 = rng.random_sample((3, 1000)) * 10
+    >>> v1 = np.dot(m[:3, :3], v0) + m[:3, 3:]
+    >>> chunks = [(v0[:, i:i+100], v1[:, i:i+100])
+    ...           for i in range(0, 1000, 100)]
+    >>> np.allclose(affine_matrix_from_points_chunked(chunks, 'svd'), m)
+    True
+    >>> np.allclose(affine_matrix_from_points_chunked(chunks, 'lstsq'), m)
+    True
+
+    With errors in both point sets, 'svd' reproduces
+    affine_matrix_from_points and 'lstsq' does not:
+
+    >>> n0 = v0 + rng.normal(0, 0.5, v0.shape)
+    >>> n1 = v1 + rng.normal(0, 0.5, v1.shape)
+    >>> chunks = [(n0[:, i:i+100], n1[:, i:i+100])
+    ...           for i in range(0, 1000, 100)]
+    >>> expected = affine_matrix_from_points(n0, n1, shear=True)
+    >>> np.allclose(affine_matrix_from_points_chunked(chunks, 'svd'),
+    ...             expected)
+    True
+    >>> lstsq = affine_matrix_from_points_chunked(chunks, 'lstsq')
+    >>> np.abs(lstsq - expected).max() > 0.01
+    True
+    >>> np.linalg.norm(lstsq[:3, :3]) < np.linalg.norm(expected[:3, :3])
+    True
+
+    """
+    def __init__(self, method='svd'):
+        if method not in ('svd', 'lstsq'):
+            raise ValueError('unknown method %s' % method)
+        self.method = method
+        self._moments = _Moments()
+
+    @property
+    def weight(self):
+        return self._moments.weight
+
+    @property
+    def ndims(self):
+        return None if self._moments.mean is None \
+            else self._moments.mean.shape[0] // 2
+
+    def add(self, v0, v1, weights=None):
+        r"""Add a chunk of corresponding points
+
+        Parameters
+        ----------
+        v0 : array of shape (ndims, N)
+        v1 : array of shape (ndims, N)
+        weights : array of shape (N,) or None
+
+        """
+        self._moments.add(_stack(v0, v1), weights)
+
+    def update(self, other):
+        r"""Merge the accumulators of another IncrementalAffineRegistrar"""
+        self._moments.update(other._moments)
+
+    def matrix(self):
+        r"""Affine matrix of the points added so far
+
+        Returns
+        -------
+        (ndims+1)x(ndims+1) matrix transforming v0 points into v1 points
+
+        """
+        ndims = self.ndims
+        if ndims is None or self.weight < ndims:
+            raise ValueError('not enough points were added')
+        scatter = self._moments.scatter
+        if self.method == 'svd':
+            w, v = np.linalg.eigh(scatter)
+            v = v[:, np.argsort(w)[::-1][:ndims]]
+            a = np.dot(v[ndims:], np.linalg.pinv(v[:ndims]))
+        else:
+            a = np.linalg.solve(scatter[:ndims, :ndims],
+                                scatter[ndims:, :ndims].T).T
+        mean = self._moments.mean
+        m = np.identity(ndims + 1)
+        m[:ndims, :ndims] = a
+        m[:ndims, ndims] = mean[ndims:] - np.dot(a, mean[:ndims])
+        return m
+
+
+def superimposition_matrix_chunked(chunks, scale=False, usesvd=True):
+    r"""Superimposition matrix of point sets given as chunks
+
+    Parameters
+    ----------
+    chunks : iterable
+        Iterable of (v0, v1) or (v0, v1, weights) tuples, v0 and v1 of shape
+        (3, N)
+    scale : bool
+    usesvd : bool
+
+    Returns
+    -------
+    4x4 matrix
+
+    Examples
+    --------
+    The result is the superimposition matrix of the whole point sets:
+
+    >>> from transformations.transformations import (
+    ...     concatenate_matrices, random_rotation_matrix, scale_matrix,
+    ...     superimposition_matrix, translation_matrix)
+    >>> rng = np.random.RandomState(1)
+    >>> m = concatenate_matrices(translation_matrix([10, -5, 3]),
+    ...                          random_rotation_matrix(rng.random_sample(3)),
+    ...                          scale_matrix(1.5))
+    >>> v0 = rng.random_sample((3, 1000)) * 100 + 1000
+    >>> v1 = np.dot(m[:3, :3], v0) + m[:3, 3:] + rng.normal(0, 0.5, v0.shape)
+    >>> chunks = [(v0[:, i:i+100], v1[:, i:i+100])
+    ...           for i in range(0, 1000, 100)]
+    >>> all(np.allclose(superimposition_matrix_chunked(chunks, scale, usesvd),
+    ...                 superimposition_matrix(v0, v1, scale, usesvd))
+    ...     for scale in (False, True) for usesvd in (True, False))
+    True
+
+    Integer weights are equivalent to repeated points:
+
+    >>> w = rng.randint(0, 3, 1000)
+    >>> chunks = [(v0[:, i:i+100], v1[:, i:i+100], w[i:i+100])
+    ...           for i in range(0, 1000, 100)]
+    >>> np.allclose(superimposition_matrix_chunked(chunks, scale=True),
+    ...             superimposition_matrix(np.repeat(v0, w, axis=1),
+    ...                                    np.repeat(v1, w, axis=1),
+    ...                                    scale=True))
+    True
+
+    """
+    registrar = IncrementalRegistrar(scale=scale, usesvd=usesvd)
+    for chunk in chunks:
+        registrar.add(*chunk)
+    return registrar.matrix()
+
+
+def affine_matrix_from_points_chunked(chunks, method='svd'):
+    r"""Affine matrix of point sets given as chunks
+
+    Parameters
+    ----------
+    chunks : iterable
+        Iterable of (v0, v1) or (v0, v1, weights) tuples, v0 and v1 of shape
+        (ndims, N)
+    method : str
+        'svd' or 'lstsq', see IncrementalAffineRegistrar
+
+    Returns
+    -------
+    (ndims+1)x(ndims+1) matrix
+
+    """
+    registrar = IncrementalAffineRegistrar(method=method)
+    for chunk in chunks:
+        registrar.add(*chunk)
+    return registrar.matrix()
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,193 @@
+# coding: utf-8
+
+r"""Out-of-core transformation of point files larger than memory
+
+The input file is mapped with numpy.memmap and transformed chunk by chunk
+into a memory-mapped output file. Files are either .npy files holding an
+(N, 3) array or raw binary files of (x, y, z) float records.
+
+Command line usage::
+
+    python -m transformations.streaming matrix.txt in.npy out.npy
+    python -m transformations.streaming matrix.npy in.bin out.bin \
+        --dtype float32 --chunk-size 131072
+
+where the matrix file is a 4x4 matrix saved with numpy.savetxt or numpy.save,
+e.g. the result of superimposition_matrix or affine_matrix_from_points.
+
+The doctests are run with::
+
+    python -c "import doctest, transformations.streaming as m; doctest.testmod(m)"
+"""
+
+import argparse
+
+import numpy as np
+
+from transformations.points import transform_points, transform_vectors, \
+    DEFAULT_CHUNK_SIZE
+
+
+def _is_npy(path):
+    return str(path).endswith('.npy')
+
+
+def open_points(path, dtype=np.float64, mode='r'):
+    r"""Memory map an (N, 3) points file
+
+    Parameters
+    ----------
+    path : str
+        .npy file or raw binary file
+    dtype : numpy dtype
+        dtype of the raw binary file, ignored for .npy files
+    mode : str
+        numpy.memmap mode
+
+    Returns
+    -------
+    numpy.memmap of shape (N, 3)
+
+    """
+    if _is_npy(path):
+        points = np.load(path, mmap_mode=mode)
+    else:
+        points = np.memmap(path, dtype=dtype, mode=mode)
+        assert points.size % 3 == 0, "raw file size is not a multiple of 3"
+        points = points.reshape(-1, 3)
+    assert points.ndim == 2 and points.shape[1] == 3, "expected (N, 3) array"
+    return points
+
+
+def create_points(path, shape, dtype=np.float64):
+    r"""Create a memory-mapped points file, .npy or raw binary
+
+    Parameters
+    ----------
+    path : str
+    shape : tuple
+    dtype : numpy dtype
+
+    Returns
+    -------
+    numpy.memmap
+
+    """
+    if _is_npy(path):
+        return np.lib.format.open_memmap(path, mode='w+', dtype=dtype,
+                                         shape=shape)
+    return np.memmap(path, dtype=dtype, mode='w+', shape=shape)
+
+
+def load_matrix(path):
+    r"""Load a 4x4 matrix saved with numpy.save or numpy.savetxt
+
+    Examples
+    --------
+    >>> import os, tempfile
+    >>> tmp = tempfile.TemporaryDirectory()
+    >>> m = np.random.random_sample((4, 4))
+    >>> np.save(os.path.join(tmp.name, 'm.npy'), m)
+    >>> np.savetxt(os.path.join(tmp.name, 'm.txt'), m)
+    >>> np.array_equal(load_matrix(os.path.join(tmp.name, 'm.npy')), m)
+    True
+    >>> np.allclose(load_matrix(os.path.join(tmp.name, 'm.txt')), m)
+    True
+    >>> tmp.cleanup()
+
+    """
+    m = np.load(path) if _is_npy(path) else np.loadtxt(path)
+    assert m.shape == (4, 4), "expected a 4x4 matrix"
+    return m
+
+
+def transform_file(m, input_path, output_path, dtype=np.float64,
+                   chunk_size=DEFAULT_CHUNK_SIZE, vectors=False):
+    r"""Transform the points of a file into another file, chunk by chunk
+
+    Parameters
+    ----------
+    m : 4x4 matrix or Transform
+    input_path : str
+    output_path : str
+        May be the input path for an in-place transformation
+    dtype : numpy dtype
+        dtype of raw binary files, ignored for .npy files
+    chunk_size : int
+        Number of points read, transformed and written at once
+    vectors : bool
+        If True, the file holds direction vectors and the translation is
+        not applied
+
+    Returns
+    -------
+    int : number of transformed points
+
+    Examples
+    --------
+    >>> import os, tempfile
+    >>> from transformations.transformations import random_rotation_matrix
+    >>> tmp = tempfile.TemporaryDirectory()
+    >>> path = lambda name: os.path.join(tmp.name, name)
+    >>> m = random_rotation_matrix()
+    >>> m[:3, 3] = [1, 2, 3]
+    >>> points = np.random.random_sample((100, 3))
+    >>> np.save(path('in.npy'), points)
+    >>> transform_file(m, path('in.npy'), path('out.npy'), chunk_size=7)
+    100
+    >>> np.allclose(np.load(path('out.npy')), transform_points(m, points))
+    True
+
+    Raw float32 file transformed in place, and vectors from the command
+    line:
+
+    >>> points.astype(np.float32).tofile(path('points.bin'))
+    >>> transform_file(m, path('points.bin'), path('points.bin'),
+    ...                dtype=np.float32, chunk_size=7)
+    100
+    >>> result = np.fromfile(path('points.bin'), np.float32).reshape(-1, 3)
+    >>> np.allclose(result, transform_points(m, points), atol=1e-5)
+    True
+    >>> np.savetxt(path('m.txt'), m)
+    >>> main([path('m.txt'), path('in.npy'), path('vectors.npy'),
+    ...       '--vectors', '--chunk-size', '7'])
+    100 points transformed
+    >>> np.allclose(np.load(path('vectors.npy')), np.dot(points, m[:3, :3].T))
+    True
+    >>> tmp.cleanup()
+
+    """
+    inplace = str(input_path) == str(output_path)
+    src = open_points(input_path, dtype=dtype, mode='r+' if inplace else 'r')
+    dst = src if inplace else create_points(output_path, src.shape, src.dtype)
+    transform = transform_vectors if vectors else transform_points
+    for start in range(0, src.shape[0], chunk_size):
+        chunk = slice(start, start + chunk_size)
+        transform(m, src[chunk], out=dst[chunk], chunk_size=chunk_size)
+    dst.flush()
+    return src.shape[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Transform a points file larger than memory with a 4x4 "
+                    "matrix")
+    parser.add_argument('matrix', help="4x4 matrix file (.npy or text)")
+    parser.add_argument('input', help="input points file (.npy or raw)")
+    parser.add_argument('output', help="output points file (.npy or raw)")
+    parser.add_argument('--dtype', default='float64',
+                        choices=('float32', 'float64'),
+                        help="dtype of raw files (default: float64)")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="points per chunk (default: %(default)s)")
+    parser.add_argument('--vectors', action='store_true',
+                        help="the file holds vectors, ignore the translation")
+    args = parser.parse_args(argv)
+    n = transform_file(load_matrix(args.matrix), args.input, args.output,
+                       dtype=np.dtype(args.dtype), chunk_size=args.chunk_size,
+                       vectors=args.vectors)
+    print("%i points transformed" % n)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,296 @@
+# coding: utf-8
+
+r"""Typed 4x4 transformation with fast paths for the usual kinds of
+transformations (translation only, rigid ...)"""
+
+import numpy as np
+
+# Kinds of transformations, from the most to the least specific.
+# A composition is of the least specific kind of its operands.
+IDENTITY = 0
+TRANSLATION = 1
+RIGID = 2
+SIMILARITY = 3
+AFFINE = 4
+PROJECTIVE = 5
+
+KIND_NAMES = {IDENTITY: 'identity',
+              TRANSLATION: 'translation',
+              RIGID: 'rigid',
+              SIMILARITY: 'similarity',
+              AFFINE: 'affine',
+              PROJECTIVE: 'projective'}
+
+
+def classify_matrix(m, tol=1e-9):
+    r"""Kind of the transformation performed by a 4x4 matrix
+
+    Parameters
+    ----------
+    m : 4x4 matrix
+    tol : float
+        Absolute tolerance of the tests
+
+    Returns
+    -------
+    int : one of IDENTITY, TRANSLATION, RIGID, SIMILARITY, AFFINE, PROJECTIVE
+
+    Examples
+    --------
+    >>> from transformations.transformations import (
+    ...     rotation_matrix, scale_matrix, shear_matrix, translation_matrix)
+    >>> matrices = [np.identity(4), translation_matrix([1, 2, 3]),
+    ...             rotation_matrix(0.5, [1, 0, 1], [1, 2, 3]),
+    ...             scale_matrix(2.0), scale_matrix(-2.0, direction=[0, 1, 0]),
+    ...             shear_matrix(0.5, [1, 0, 0], [0, 0, 0], [0, 0, 1])]
+    >>> [KIND_NAMES[classify_matrix(m)] for m in matrices]
+    ['identity', 'translation', 'rigid', 'similarity', 'affine', 'affine']
+    >>> m = np.identity(4)
+    >>> m[3, 0] = 0.1
+    >>> KIND_NAMES[classify_matrix(m)]
+    'projective'
+
+    """
+    m = np.asarray(m, dtype=float)
+    assert m.shape == (4, 4)
+    if not np.allclose(m[3], (0., 0., 0., 1.), rtol=0., atol=tol):
+        return PROJECTIVE
+    a = m[:3, :3]
+    if np.allclose(a, np.identity(3), rtol=0., atol=tol):
+        if np.allclose(m[:3, 3], 0., rtol=0., atol=tol):
+            return IDENTITY
+        return TRANSLATION
+    ata = np.dot(a.T, a)
+    if np.allclose(ata, np.identity(3), rtol=0., atol=tol):
+        return RIGID
+    if np.allclose(ata, ata[0, 0] * np.identity(3), rtol=0., atol=tol) \
+            and ata[0, 0] > tol:
+        return SIMILARITY
+    return AFFINE
+
+
+class Transform(object):
+    r"""4x4 homogeneous transformation that knows its kind
+
+    The kind selects cheaper kernels for composition, inversion and
+    application to points: vector additions for translations, transposed
+    rotations for rigid transformations, 3x3 products for affine
+    transformations. A Transform can be used wherever a 4x4 array is
+    expected (np.dot, concatenate_matrices, Part.add_matrix ...). Only
+    Transform @ matrix composes Transforms: matrix @ Transform is the plain
+    4x4 array product.
+
+    Parameters
+    ----------
+    matrix : 4x4 matrix
+    kind : int or None
+        Kind of the transformation, computed with classify_matrix if None.
+        Only pass a kind that is known to be correct.
+
+    Examples
+    --------
+    The kernels of all kinds agree with the 4x4 matrix operations:
+
+    >>> from transformations.transformations import (
+    ...     random_rotation_matrix, scale_matrix, translation_matrix)
+    >>> rng = np.random.RandomState(0)
+    >>> t = translation_matrix(rng.random_sample(3) - 0.5)
+    >>> r = np.dot(t, random_rotation_matrix(rng.random_sample(3)))
+    >>> a = np.identity(4)
+    >>> a[:3] += rng.random_sample((3, 4)) - 0.5
+    >>> p = a.copy()
+    >>> p[3, :3] = rng.random_sample(3) * 0.1
+    >>> transforms = [Transform(m) for m in (
+    ...     np.identity(4), t, r, np.dot(r, scale_matrix(1.5)), a, p)]
+    >>> [x.kind_name for x in transforms]
+    ['identity', 'translation', 'rigid', 'similarity', 'affine', 'projective']
+    >>> all(np.allclose((x @ y).matrix, np.dot(x.matrix, y.matrix)) and
+    ...     (x @ y).kind == max(x.kind, y.kind)
+    ...     for x in transforms for y in transforms)
+    True
+    >>> all(np.allclose(x.inverse().matrix, np.linalg.inv(x.matrix)) and
+    ...     x.inverse().kind == x.kind for x in transforms)
+    True
+    >>> points = rng.random_sample((5, 3))
+    >>> h = np.hstack((points, np.ones((5, 1))))
+    >>> all(np.allclose(x.apply(points), np.dot(h, x.matrix.T)[:, :3] /
+    ...                 np.dot(h, x.matrix.T)[:, 3:]) and
+    ...     np.allclose(x.apply(points[0]), x.apply(points)[0])
+    ...     for x in transforms)
+    True
+    >>> all(np.allclose(x.apply_vectors(points), np.dot(points, x.linear.T))
+    ...     for x in transforms)
+    True
+    >>> type(r @ transforms[1])
+    <class 'numpy.ndarray'>
+
+    """
+    __slots__ = ('_matrix', '_kind')
+
+    def __init__(self, matrix, kind=None):
+        matrix = np.array(matrix, dtype=float)
+        assert matrix.shape == (4, 4)
+        matrix.flags.writeable = False
+        self._matrix = matrix
+        self._kind = classify_matrix(matrix) if kind is None else kind
+
+    @classmethod
+    def identity(cls):
+        return cls(np.identity(4), IDENTITY)
+
+    @classmethod
+    def from_translation(cls, t):
+        r"""Transform that translates by vector t"""
+        m = np.identity(4)
+        m[:3, 3] = t[:3]
+        return cls(m, TRANSLATION)
+
+    @classmethod
+    def from_rigid(cls, rotation, t=(0., 0., 0.)):
+        r"""Transform from a 3x3 rotation matrix and a translation vector"""
+        m = np.identity(4)
+        m[:3, :3] = rotation
+        m[:3, 3] = t[:3]
+        return cls(m, RIGID)
+
+    @property
+    def matrix(self):
+        r"""Read-only 4x4 matrix"""
+        return self._matrix
+
+    @property
+    def kind(self):
+        return self._kind
+
+    @property
+    def kind_name(self):
+        return KIND_NAMES[self._kind]
+
+    @property
+    def linear(self):
+        r"""Read-only 3x3 linear part (rotation, scale, shear)"""
+        return self._matrix[:3, :3]
+
+    @property
+    def translation(self):
+        r"""Read-only translation vector"""
+        return self._matrix[:3, 3]
+
+    def __array__(self, dtype=None, copy=None):
+        if copy or (dtype is not None and
+                    np.dtype(dtype) != self._matrix.dtype):
+            if copy is False:
+                raise ValueError('a copy is required to convert to %s' %
+                                 np.dtype(dtype))
+            return np.array(self._matrix, dtype=dtype)
+        return self._matrix
+
+    def __repr__(self):
+        return "Transform(kind=%s,\n%s)" % (self.kind_name, self._matrix)
+
+    def compose(self, other):
+        r"""Transform that applies other, then self (i.e. self . other)
+
+        Parameters
+        ----------
+        other : Transform or 4x4 matrix
+
+        Returns
+        -------
+        Transform
+
+        """
+        if not isinstance(other, Transform):
+            other = Transform(other)
+        if other.kind == IDENTITY:
+            return self
+        if self.kind == IDENTITY:
+            return other
+        kind = max(self.kind, other.kind)
+        if kind == TRANSLATION:
+            return Transform.from_translation(self.translation +
+                                              other.translation)
+        if kind == PROJECTIVE:
+            return Transform(np.dot(self._matrix, other.matrix), kind)
+        m = np.identity(4)
+        if self.kind == TRANSLATION:
+            m[:3, :3] = other.linear
+            m[:3, 3] = other.translation + self.translation
+        elif other.kind == TRANSLATION:
+            m[:3, :3] = self.linear
+            m[:3, 3] = np.dot(self.linear, other.translation) + \
+                self.translation
+        else:
+            m[:3, :3] = np.dot(self.linear, other.linear)
+            m[:3, 3] = np.dot(self.linear, other.translation) + \
+                self.translation
+        return Transform(m, kind)
+
+    def __matmul__(self, other):
+        if isinstance(other, Transform) or np.shape(other) == (4, 4):
+            return self.compose(other)
+        return NotImplemented
+
+    def inverse(self):
+        r"""Inverse Transform, of the same kind"""
+        if self.kind == IDENTITY:
+            return self
+        if self.kind == TRANSLATION:
+            return Transform.from_translation(-self.translation)
+        if self.kind == PROJECTIVE:
+            return Transform(np.linalg.inv(self._matrix), PROJECTIVE)
+        if self.kind == RIGID:
+            a = self.linear.T
+        elif self.kind == SIMILARITY:
+            a = self.linear.T / np.dot(self.linear[:, 0], self.linear[:, 0])
+        else:
+            a = np.linalg.inv(self.linear)
+        m = np.identity(4)
+        m[:3, :3] = a
+        m[:3, 3] = -np.dot(a, self.translation)
+        return Transform(m, self.kind)
+
+    def apply(self, points):
+        r"""Apply the transformation to points
+
+        Parameters
+        ----------
+        points : array of shape (3,) or (N, 3)
+
+        Returns
+        -------
+        array of the same shape as points
+
+        """
+        points = np.asarray(points, dtype=float)
+        if self.kind == IDENTITY:
+            return points.copy()
+        if self.kind == TRANSLATION:
+            return points + self.translation
+        if self.kind == PROJECTIVE:
+            h = np.dot(points, self.linear.T) + self.translation
+            w = np.dot(points, self._matrix[3, :3]) + self._matrix[3, 3]
+            return h / np.expand_dims(w, -1)
+        return np.dot(points, self.linear.T) + self.translation
+
+    def apply_vectors(self, vectors):
+        r"""Apply the transformation to direction vectors (no translation)
+
+        Parameters
+        ----------
+        vectors : array of shape (3,) or (N, 3)
+
+        Returns
+        -------
+        array of the same shape as vectors
+
+        """
+        vectors = np.asarray(vectors, dtype=float)
+        if self.kind in (IDENTITY, TRANSLATION):
+            return vectors.copy()
+        return np.dot(vectors, self.linear.T)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -60,6 +60,12 @@ The API is not stable yet and is expected to change between revisions.
 This Python code is not optimized for speed. Refer to the transformations.c
 module for a faster implementation of some functions.
 
+Implementations are organized in backends: the pure Python and NumPy
+reference backend 'numpy', the compiled transformations.c extension 'c'
+(activated on import if available), and the JIT compiled backend 'numba'
+(if numba is installed). Use list_backends, use_backend, active_backend, and
+check_backend to select and verify implementations per function.
+
 Documentation in HTML format can be generated with epydoc.
 
 Matrices (M) can be inverted using numpy.linalg.inv(M), be concatenated using
@@ -73,7 +79,35 @@ of the transformation matrix, i.e. M[:3, 3].
 The transpose of the transformation matrices may have to be used to interface
 with other graphics systems, e.g. with OpenGL's glMultMatrixd(). See also [16].
 
-Calculations are carried out with numpy.float64 precision.
+Calculations are carried out with numpy.float64 precision by default.
+Constructors (e.g. translation_matrix, rotation_matrix, euler_matrix,
+quaternion_matrix, compose_matrix), batched constructors (e.g.
+euler_matrix_batch, compose_matrix_batch, quaternion_slerp_batch), and
+quaternion operations (including quaternion_slerp and quaternion_from_matrix,
+but not quaternion_real, which returns a float) return arrays in the module
+precision. It can be set to numpy.float32 with set_precision or the
+precision context manager, halving memory and bandwidth of large stacks of
+matrices. Batched
+constructors compute in that precision and also take a dtype argument,
+scalar constructors compute in float64 and round the result. Functions that
+decompose matrices or register point sets always compute in float64. The
+compiled extension module ignores the module precision.
+
+Float32 (eps = 1.2e-7) is safe for placing and displaying geometry:
+
+- Elements of rotation matrices computed in float32 by batched
+  constructors are within 6e-7 of the float64 matrices, and R.T R differs
+  from the identity by up to 1.3e-6 (measured for 3e5 random matrices of
+  rotation_matrix and quaternion_matrix_batch). Scalar constructors round
+  float64 results: elements are within 3e-8, R.T R within 1e-7.
+- Transforming points with coordinates of magnitude L loses about 1e-7 * L,
+  e.g. 0.1 um at 1 m, plus the rounding of the translation.
+- Errors grow with the number of concatenated matrices, to about 1e-6
+  after 100 matrices. Concatenate in float64 for long kinematic chains.
+
+Float32 is not safe for angles and axes recovered from nearly degenerate
+matrices, for registration, or for coordinates spanning more than about
+1e5 times the required accuracy.
 
 Vector, point, quaternion, and matrix function arguments are expected to be
 "array like", i.e. tuple, list, or numpy arrays.
@@ -195,6 +229,7 @@ True
 
 from __future__ import division, print_function
 
+import contextlib
 import math
 
 import numpy
@@ -216,20 +251,29 @@ def identity_matrix():
     True
 
     """
-    return numpy.identity(4)
+    return numpy.identity(4, _PRECISION)
 
 
-def translation_matrix(direction):
+def translation_matrix(direction, out=None):
     """Return matrix to translate by direction vector.
 
+    If out is given, the matrix is stored there and None is returned.
+
     >>> v = numpy.random.random(3) - 0.5
     >>> numpy.allclose(v, translation_matrix(v)[:3, 3])
     True
+    >>> M = numpy.empty((4, 4))
+    >>> translation_matrix(v, out=M)
+    >>> numpy.allclose(M, translation_matrix(v))
+    True
 
     """
-    M = numpy.identity(4)
-    M[:3, 3] = direction[:3]
-    return M
+    if out is None:
+        M = numpy.identity(4)
+        M[:3, 3] = direction[:3]
+        return _astype(M)
+    _identity(out)
+    out[:3, 3] = direction[:3]
 
 
 def translation_from_matrix(matrix):
@@ -267,7 +311,7 @@ def reflection_matrix(point, normal):
     M = numpy.identity(4)
     M[:3, :3] -= 2.0 * numpy.outer(normal, normal)
     M[:3, 3] = (2.0 * numpy.dot(point[:3], normal)) * normal
-    return M
+    return _astype(M)
 
 
 def reflection_from_matrix(matrix):
@@ -299,9 +343,17 @@ def reflection_from_matrix(matrix):
     return point, normal
 
 
-def rotation_matrix(angle, direction, point=None):
+def rotation_matrix(angle, direction, point=None, out=None):
     """Return matrix to rotate about axis defined by point and direction.
 
+    If angle, direction or point are arrays of shape (N, ), (N, 3) and (N, 3)
+    respectively (or any mix of broadcastable shapes), a C contiguous array
+    of shape (N, 4, 4) is returned, computed in a single pass in the module
+    precision.
+
+    If out is given, the matrix or stack of matrices is stored there and
+    None is returned.
+
     >>> R = rotation_matrix(math.pi/2, [0, 0, 1], [1, 0, 0])
     >>> numpy.allclose(numpy.dot(R, [0, 0, 0, 1]), [1, -1, 0, 1])
     True
@@ -322,24 +374,101 @@ def rotation_matrix(angle, direction, point=None):
     >>> numpy.allclose(2, numpy.trace(rotation_matrix(math.pi/2,
     ...                                               direc, point)))
     True
+    >>> angles = (numpy.random.random(5) - 0.5) * (2*math.pi)
+    >>> direcs = numpy.random.random((5, 3)) - 0.5
+    >>> R = rotation_matrix(angles, direcs, point)
+    >>> R.shape, R.flags['C_CONTIGUOUS']
+    ((5, 4, 4), True)
+    >>> all(numpy.allclose(R[i], rotation_matrix(angles[i], direcs[i], point))
+    ...     for i in range(5))
+    True
+    >>> R = rotation_matrix(angles, [0, 0, 1])
+    >>> numpy.allclose(R[2], rotation_matrix(angles[2], [0, 0, 1]))
+    True
+    >>> M = numpy.empty((4, 4))
+    >>> rotation_matrix(angle, direc, point, out=M)
+    >>> numpy.allclose(M, R0)
+    True
+    >>> rotation_matrix(angles, [0, 0, 1], out=R)
+    >>> numpy.allclose(R[2], rotation_matrix(angles[2], [0, 0, 1]))
+    True
+    >>> numpy.isnan(rotation_matrix(angle, [0, 0, 0])[:3, :3]).all()
+    True
 
     """
+    if _ndim(angle) or _ndim(direction) > 1 or (
+            point is not None and _ndim(point) > 1):
+        M = _rotation_matrices(angle, direction, point, out=out)
+        return M if out is None else None
     sina = math.sin(angle)
     cosa = math.cos(angle)
-    direction = unit_vector(direction[:3])
+    x, y, z = float(direction[0]), float(direction[1]), float(direction[2])
+    n = math.sqrt(x*x + y*y + z*z)
+    if n == 0.0:
+        # undefined axis gives nan matrix as with numpy division
+        x = y = z = math.nan
+    else:
+        x, y, z = x / n, y / n, z / n
     # rotation matrix around unit vector
-    R = numpy.diag([cosa, cosa, cosa])
-    R += numpy.outer(direction, direction) * (1.0 - cosa)
-    direction *= sina
-    R += numpy.array([[ 0.0,         -direction[2],  direction[1]],
-                      [ direction[2], 0.0,          -direction[0]],
-                      [-direction[1], direction[0],  0.0]])
-    M = numpy.identity(4)
-    M[:3, :3] = R
+    c = 1.0 - cosa
+    R = ((cosa + x*x*c, x*y*c - z*sina, x*z*c + y*sina),
+         (x*y*c + z*sina, cosa + y*y*c, y*z*c - x*sina),
+         (x*z*c - y*sina, y*z*c + x*sina, cosa + z*z*c))
+    if point is None:
+        t = (0.0, 0.0, 0.0)
+    else:
+        # rotation not around origin
+        px, py, pz = float(point[0]), float(point[1]), float(point[2])
+        t = (px - (R[0][0]*px + R[0][1]*py + R[0][2]*pz),
+             py - (R[1][0]*px + R[1][1]*py + R[1][2]*pz),
+             pz - (R[2][0]*px + R[2][1]*py + R[2][2]*pz))
+    return _matrix((R[0] + (t[0], ), R[1] + (t[1], ), R[2] + (t[2], ),
+                    (0.0, 0.0, 0.0, 1.0)), out)
+
+
+def _rotation_matrices(angle, direction, point=None, dtype=None, out=None):
+    """Return stack of rotation matrices from broadcastable array arguments.
+
+    Implementation of rotation_matrix for array arguments.
+
+    """
+    dtype = _dtype(dtype) if out is None else out.dtype
+    angle = numpy.array(angle, dtype=dtype, copy=False)
+    direction = numpy.array(direction, dtype=dtype, copy=False)
+    direction = direction[..., :3]
+    direction = direction / numpy.sqrt(
+        numpy.sum(direction * direction, axis=-1))[..., numpy.newaxis]
+    if point is not None:
+        point = numpy.array(point, dtype=dtype, copy=False)[..., :3]
+        shape = numpy.broadcast(angle, direction[..., 0], point[..., 0]).shape
+    else:
+        shape = numpy.broadcast(angle, direction[..., 0]).shape
+    sina = numpy.sin(angle)
+    cosa = numpy.cos(angle)
+    if out is None:
+        M = numpy.zeros(shape + (4, 4), dtype)
+    else:
+        if out.shape != shape + (4, 4):
+            raise ValueError('out must be of shape %s' % (shape + (4, 4), ))
+        M = out
+        M[...] = 0.0
+    R = M[..., :3, :3]
+    # rotation matrix around unit vectors
+    R += direction[..., :, numpy.newaxis] * direction[..., numpy.newaxis, :]
+    R *= (1.0 - cosa)[..., numpy.newaxis, numpy.newaxis]
+    for i in range(3):
+        R[..., i, i] += cosa
+    direction = direction * sina[..., numpy.newaxis]
+    R[..., 0, 1] -= direction[..., 2]
+    R[..., 0, 2] += direction[..., 1]
+    R[..., 1, 0] += direction[..., 2]
+    R[..., 1, 2] -= direction[..., 0]
+    R[..., 2, 0] -= direction[..., 1]
+    R[..., 2, 1] += direction[..., 0]
+    M[..., 3, 3] = 1.0
     if point is not None:
         # rotation not around origin
-        point = numpy.array(point[:3], dtype=numpy.float64, copy=False)
-        M[:3, 3] = point - numpy.dot(R, point)
+        M[..., :3, 3] = point - numpy.einsum('...ij,...j->...i', R, point)
     return M
 
 
@@ -383,11 +512,13 @@ def rotation_from_matrix(matrix):
     return angle, direction, point
 
 
-def scale_matrix(factor, origin=None, direction=None):
+def scale_matrix(factor, origin=None, direction=None, out=None):
     """Return matrix to scale by factor around origin in direction.
 
     Use factor -1 for point symmetry.
 
+    If out is given, the matrix is stored there and None is returned.
+
     >>> v = (numpy.random.rand(4, 5) - 0.5) * 20
     >>> v[3] = 1
     >>> S = scale_matrix(-1.234)
@@ -398,23 +529,33 @@ def scale_matrix(factor, origin=None, direction=None):
     >>> direct = numpy.random.random(3) - 0.5
     >>> S = scale_matrix(factor, origin)
     >>> S = scale_matrix(factor, origin, direct)
+    >>> M = numpy.empty((4, 4))
+    >>> scale_matrix(factor, origin, direct, out=M)
+    >>> numpy.allclose(M, S)
+    True
 
     """
     if direction is None:
         # uniform scaling
-        M = numpy.diag([factor, factor, factor, 1.0])
-        if origin is not None:
-            M[:3, 3] = origin[:3]
-            M[:3, 3] *= 1.0 - factor
-    else:
-        # nonuniform scaling
-        direction = unit_vector(direction[:3])
-        factor = 1.0 - factor
-        M = numpy.identity(4)
-        M[:3, :3] -= factor * numpy.outer(direction, direction)
-        if origin is not None:
-            M[:3, 3] = (factor * numpy.dot(origin[:3], direction)) * direction
-    return M
+        if origin is None:
+            t = (0.0, 0.0, 0.0)
+        else:
+            t = (float(origin[0]) * (1.0 - factor),
+                 float(origin[1]) * (1.0 - factor),
+                 float(origin[2]) * (1.0 - factor))
+        return _matrix(((factor, 0.0, 0.0, t[0]),
+                        (0.0, factor, 0.0, t[1]),
+                        (0.0, 0.0, factor, t[2]),
+                        (0.0, 0.0, 0.0, 1.0)), out)
+    # nonuniform scaling
+    direction = unit_vector(direction[:3])
+    factor = 1.0 - factor
+    M = numpy.identity(4) if out is None else _identity(out)
+    M[:3, :3] -= factor * numpy.outer(direction, direction)
+    if origin is not None:
+        M[:3, 3] = (factor * numpy.dot(origin[:3], direction)) * direction
+    if out is None:
+        return _astype(M)
 
 
 def scale_from_matrix(matrix):
@@ -517,7 +658,7 @@ def projection_matrix(point, normal, direction=None,
         # orthogonal projection
         M[:3, :3] -= numpy.outer(normal, normal)
         M[:3, 3] = numpy.dot(point, normal) * normal
-    return M
+    return _astype(M)
 
 
 def projection_from_matrix(matrix, pseudo=False):
@@ -642,7 +783,7 @@ def clip_matrix(left, right, bottom, top, near, far, perspective=False):
              [0.0, 2.0/(top-bottom), 0.0, (top+bottom)/(bottom-top)],
              [0.0, 0.0, 2.0/(far-near), (far+near)/(near-far)],
              [0.0, 0.0, 0.0, 1.0]]
-    return numpy.array(M)
+    return numpy.array(M, _PRECISION)
 
 
 def shear_matrix(angle, direction, point, normal):
@@ -673,7 +814,7 @@ def shear_matrix(angle, direction, point, normal):
     M = numpy.identity(4)
     M[:3, :3] += angle * numpy.outer(direction, normal)
     M[:3, 3] = -angle * numpy.dot(point[:3], normal) * direction
-    return M
+    return _astype(M)
 
 
 def shear_from_matrix(matrix):
@@ -856,6 +997,162 @@ def compose_matrix(scale=None, shear=None, angles=None, translate=None,
         S[2, 2] = scale[2]
         M = numpy.dot(M, S)
     M /= M[3, 3]
+    return _astype(M)
+
+
+def decompose_matrix_batch(matrices):
+    """Return sequences of transformations from stack of matrices.
+
+    matrices : array_like of shape (N, 4, 4)
+        Homogeneous transformation matrices
+
+    Return tuple of:
+        scale : array of shape (N, 3) of scaling factors
+        shear : array of shape (N, 3) of shear factors for x-y, x-z, y-z axes
+        angles : array of shape (N, 3) of Euler angles about static x, y, z
+        translate : array of shape (N, 3) of translation vectors
+        perspective : array of shape (N, 4) of perspective partitions
+        valid : boolean array of shape (N, )
+
+    Instead of raising ValueError as decompose_matrix does, degenerative
+    or singular matrices are marked False in valid, and their partitions
+    are set to NaN.
+
+    >>> M = [compose_matrix(*[numpy.random.random(n) - 0.5
+    ...                       for n in (3, 3, 3, 3, 4)]) for _ in range(4)]
+    >>> M.append(numpy.zeros((4, 4)))
+    >>> M.append(scale_matrix(0.0))
+    >>> M.append(euler_matrix(0.1, math.pi/2, 0.3))
+    >>> scale, shear, angles, trans, persp, valid = decompose_matrix_batch(M)
+    >>> valid
+    array([ True,  True,  True,  True, False, False,  True], dtype=bool)
+    >>> numpy.isnan(scale[4:6]).all()
+    True
+    >>> all(numpy.allclose(numpy.hstack(decompose_matrix(M[i])),
+    ...                    numpy.hstack([scale[i], shear[i], angles[i],
+    ...                                  trans[i], persp[i]]))
+    ...     for i in (0, 1, 2, 3, 6))
+    True
+
+    """
+    M = numpy.array(matrices, dtype=numpy.float64, copy=False)
+    M = numpy.swapaxes(M, -1, -2).reshape(-1, 4, 4).copy()
+    valid = numpy.abs(M[:, 3, 3]) >= _EPS
+    M[~valid] = numpy.identity(4)
+    M /= M[:, 3:, 3:]
+    P = M.copy()
+    P[:, :, 3] = 0.0, 0.0, 0.0, 1.0
+    valid &= numpy.linalg.det(P) != 0.0
+    P[~valid] = numpy.identity(4)
+    M[~valid] = numpy.identity(4)
+
+    perspective = numpy.zeros((M.shape[0], 4))
+    perspective[:, 3] = 1.0
+    index = numpy.any(numpy.abs(M[:, :3, 3]) > _EPS, axis=1)
+    if numpy.any(index):
+        perspective[index] = numpy.einsum(
+            'ni,nij->nj', M[index, :, 3],
+            numpy.linalg.inv(numpy.swapaxes(P[index], -1, -2)))
+        M[index, :, 3] = 0.0, 0.0, 0.0, 1.0
+
+    translate = M[:, 3, :3].copy()
+
+    row = M[:, :3, :3]
+    scale = numpy.empty((M.shape[0], 3))
+    shear = numpy.empty((M.shape[0], 3))
+    scale[:, 0] = numpy.sqrt(numpy.sum(row[:, 0] * row[:, 0], axis=1))
+    row[:, 0] /= scale[:, 0, numpy.newaxis]
+    shear[:, 0] = numpy.sum(row[:, 0] * row[:, 1], axis=1)
+    row[:, 1] -= row[:, 0] * shear[:, 0, numpy.newaxis]
+    scale[:, 1] = numpy.sqrt(numpy.sum(row[:, 1] * row[:, 1], axis=1))
+    row[:, 1] /= scale[:, 1, numpy.newaxis]
+    shear[:, 0] /= scale[:, 1]
+    shear[:, 1] = numpy.sum(row[:, 0] * row[:, 2], axis=1)
+    row[:, 2] -= row[:, 0] * shear[:, 1, numpy.newaxis]
+    shear[:, 2] = numpy.sum(row[:, 1] * row[:, 2], axis=1)
+    row[:, 2] -= row[:, 1] * shear[:, 2, numpy.newaxis]
+    scale[:, 2] = numpy.sqrt(numpy.sum(row[:, 2] * row[:, 2], axis=1))
+    row[:, 2] /= scale[:, 2, numpy.newaxis]
+    shear[:, 1:] /= scale[:, 2, numpy.newaxis]
+
+    index = numpy.sum(row[:, 0] * numpy.cross(row[:, 1], row[:, 2]),
+                      axis=1) < 0
+    numpy.negative(scale, out=scale, where=index[:, numpy.newaxis])
+    numpy.negative(row, out=row, where=index[:, numpy.newaxis, numpy.newaxis])
+
+    angles = numpy.empty((M.shape[0], 3))
+    angles[:, 1] = numpy.arcsin(numpy.clip(-row[:, 0, 2], -1.0, 1.0))
+    index = numpy.cos(angles[:, 1]) != 0.0
+    angles[:, 0] = numpy.where(index,
+                               numpy.arctan2(row[:, 1, 2], row[:, 2, 2]),
+                               numpy.arctan2(-row[:, 2, 1], row[:, 1, 1]))
+    angles[:, 2] = numpy.where(index,
+                               numpy.arctan2(row[:, 0, 1], row[:, 0, 0]), 0.0)
+
+    shape = numpy.shape(matrices)[:-2]
+    result = []
+    for a in (scale, shear, angles, translate, perspective):
+        a[~valid] = numpy.nan
+        result.append(a.reshape(shape + a.shape[-1:]))
+    result.append(valid.reshape(shape))
+    return tuple(result)
+
+
+def compose_matrix_batch(scale=None, shear=None, angles=None, translate=None,
+                         perspective=None, dtype=None):
+    """Return stack of transformation matrices from sequences of transforms.
+
+    This is the inverse of the decompose_matrix_batch function.
+    The arguments are arrays of shape (N, 3), respectively (N, 4) for
+    perspective, or None. They are broadcast against each other.
+    The matrices are of type dtype, the module precision by default.
+    The matrices are assembled element-wise instead of by concatenation.
+
+    >>> scale = numpy.random.random((5, 3)) - 0.5
+    >>> shear = numpy.random.random((5, 3)) - 0.5
+    >>> angles = (numpy.random.random((5, 3)) - 0.5) * (2*math.pi)
+    >>> trans = numpy.random.random((5, 3)) - 0.5
+    >>> persp = numpy.random.random((5, 4)) - 0.5
+    >>> M0 = compose_matrix_batch(scale, shear, angles, trans, persp)
+    >>> all(numpy.allclose(M0[i], compose_matrix(scale[i], shear[i], angles[i],
+    ...                                          trans[i], persp[i]))
+    ...     for i in range(5))
+    True
+    >>> M1 = compose_matrix_batch(*decompose_matrix_batch(M0)[:5])
+    >>> numpy.allclose(M0, M1)
+    True
+    >>> M = compose_matrix_batch(translate=trans, angles=angles)
+    >>> numpy.allclose(M[1], compose_matrix(translate=trans[1],
+    ...                                     angles=angles[1]))
+    True
+
+    """
+    dtype = _dtype(dtype)
+    args = [numpy.array(a, dtype=dtype, copy=False)
+            for a in (scale, shear, angles, translate, perspective)]
+    shape = numpy.broadcast(*[a[..., 0] for a in args if a.ndim]).shape
+    scale, shear, angles, translate, perspective = args
+
+    M = numpy.zeros(shape + (4, 4), dtype)
+    if angles.ndim:
+        M[..., :3, :3] = euler_matrix_batch(angles[..., :3], 'sxyz',
+                                               dtype)[..., :3, :3]
+    else:
+        M[..., :3, :3] = numpy.identity(3)
+    if shear.ndim:
+        # columns of dot(R, Z)
+        R = M[..., :3, :3]
+        R[..., :, 2] += (R[..., :, 0] * shear[..., 1, numpy.newaxis] +
+                         R[..., :, 1] * shear[..., 2, numpy.newaxis])
+        R[..., :, 1] += R[..., :, 0] * shear[..., 0, numpy.newaxis]
+    if scale.ndim:
+        M[..., :3, :3] *= scale[..., numpy.newaxis, :3]
+    if translate.ndim:
+        M[..., :3, 3] = translate[..., :3]
+    M[..., 3, 3] = 1.0
+    if perspective.ndim:
+        M[..., 3, :] = numpy.einsum('...i,...ij->...j', perspective[..., :4], M)
+    M /= M[..., 3:, 3:]
     return M
 
 
@@ -879,11 +1176,11 @@ def orthogonalization_matrix(lengths, angles):
     sina, sinb, _ = numpy.sin(angles)
     cosa, cosb, cosg = numpy.cos(angles)
     co = (cosa * cosb - cosg) / (sina * sinb)
-    return numpy.array([
+    return _astype(numpy.array([
         [ a*sinb*math.sqrt(1.0-co*co),  0.0,    0.0, 0.0],
         [-a*sinb*co,                    b*sina, 0.0, 0.0],
         [ a*cosb,                       b*cosa, c,   0.0],
-        [ 0.0,                          0.0,    0.0, 1.0]])
+        [ 0.0,                          0.0,    0.0, 1.0]]))
 
 
 def affine_matrix_from_points(v0, v1, shear=True, scale=True, usesvd=True):
@@ -902,6 +1199,9 @@ def affine_matrix_from_points(v0, v1, shear=True, scale=True, usesvd=True):
     (RMSD) according to the algorithm by Kabsch [8].
     Otherwise, and if ndims is 3, the quaternion based algorithm by Horn [9]
     is used, which is slower when using this Python implementation.
+    If usesvd is 'auto', the faster of both algorithms for the number of
+    points is selected by select_usesvd. The selection is returned by
+    last_usesvd.
 
     The returned matrix performs rotation, translation and uniform scaling
     (if specified).
@@ -933,6 +1233,8 @@ def affine_matrix_from_points(v0, v1, shear=True, scale=True, usesvd=True):
     ndims = v0.shape[0]
     if ndims < 2 or v0.shape[1] < ndims or v0.shape != v1.shape:
         raise ValueError('input arrays are of wrong shape or type')
+    if usesvd == 'auto':
+        usesvd = _select_usesvd(v0.shape[1])
 
     # move centroids to origin
     t0 = -numpy.mean(v0, axis=1)
@@ -1046,11 +1348,217 @@ def superimposition_matrix(v0, v1, scale=False, usesvd=True):
                                      scale=scale, usesvd=usesvd)
 
 
-def euler_matrix(ai, aj, ak, axes='sxyz'):
+def superimposition_matrix_batch(v0, v1, scale=False, usesvd=True):
+    """Return matrices to transform stacks of 3D point sets into others.
+
+    v0 and v1 are shape (K, 3, \*) or (K, 4, \*) arrays of K independent
+    point sets of at least 3 points each.
+
+    The parameters scale and usesvd are explained in the more general
+    affine_matrix_from_points function. The K registrations are solved
+    with one stacked call to numpy.linalg.svd or numpy.linalg.eigh.
+    If usesvd is 'auto', the algorithm is selected by select_usesvd for
+    the number of points and the batch size. The selection is returned by
+    last_usesvd.
+
+    Return array of shape (K, 4, 4).
+
+    >>> R = numpy.array([random_rotation_matrix() for _ in range(5)])
+    >>> S = scale_matrix(random.random())
+    >>> T = translation_matrix(numpy.random.random(3)-0.5)
+    >>> v0 = (numpy.random.rand(5, 4, 100) - 0.5) * 20
+    >>> v0[:, 3] = 1
+    >>> v1 = numpy.matmul(R, v0)
+    >>> M = superimposition_matrix_batch(v0, v1)
+    >>> numpy.allclose(v1, numpy.matmul(M, v0))
+    True
+    >>> M = superimposition_matrix_batch(v0, v1, usesvd=False)
+    >>> numpy.allclose(v1, numpy.matmul(M, v0))
+    True
+    >>> v1 = numpy.matmul(concatenate_matrices(T, S), v1)
+    >>> for usesvd in (True, False):
+    ...     M = superimposition_matrix_batch(v0, v1, scale=True, usesvd=usesvd)
+    ...     for k in range(5):
+    ...         if not numpy.allclose(M[k], superimposition_matrix(
+    ...                 v0[k], v1[k], scale=True, usesvd=usesvd)):
+    ...             print(usesvd, k)
+
+    """
+    v0 = numpy.array(v0, dtype=numpy.float64, copy=False)[..., :3, :]
+    v1 = numpy.array(v1, dtype=numpy.float64, copy=False)[..., :3, :]
+    if v0.ndim < 2 or v0.shape[-1] < 3 or v0.shape != v1.shape:
+        raise ValueError('input arrays are of wrong shape or type')
+    shape = v0.shape[:-2]
+    v0 = v0.reshape((-1, ) + v0.shape[-2:])
+    v1 = v1.reshape((-1, ) + v1.shape[-2:])
+    if usesvd == 'auto':
+        usesvd = _select_usesvd(v0.shape[2], v0.shape[0])
+
+    # move centroids to origin
+    t0 = numpy.mean(v0, axis=2)
+    t1 = numpy.mean(v1, axis=2)
+    v0 = v0 - t0[:, :, numpy.newaxis]
+    v1 = v1 - t1[:, :, numpy.newaxis]
+
+    if usesvd:
+        # Rigid transformations via SVD of covariance matrices
+        u, s, vh = numpy.linalg.svd(numpy.matmul(v1, numpy.swapaxes(v0, 1, 2)))
+        # rotation matrices from SVD orthonormal bases
+        R = numpy.matmul(u, vh)
+        index = numpy.linalg.det(R) < 0.0
+        if numpy.any(index):
+            # R does not constitute right handed system
+            R[index] -= 2.0 * (u[index, :, 2, numpy.newaxis] *
+                               vh[index, numpy.newaxis, 2, :])
+    else:
+        # Rigid transformation matrices via quaternions
+        # compute symmetric matrices N, lower triangles only, from
+        # covariance matrices in a single product
+        C = numpy.matmul(v0, numpy.swapaxes(v1, 1, 2))
+        N = numpy.dot(C.reshape(-1, 9), _HORN_COEFFICIENTS)
+        # quaternions: eigenvectors corresponding to most positive eigenvalue
+        w, V = numpy.linalg.eigh(N.reshape(-1, 4, 4))
+        R = quaternion_matrix_batch(V[:, :, -1], numpy.float64)[:, :3, :3]
+
+    if scale:
+        # scale is ratio of RMS deviations from centroid
+        R *= numpy.sqrt(numpy.sum(v1 * v1, axis=(1, 2)) /
+                        numpy.sum(v0 * v0, axis=(1, 2)))[:, numpy.newaxis,
+                                                          numpy.newaxis]
+
+    # move centroids back
+    M = numpy.zeros((v0.shape[0], 4, 4))
+    M[:, :3, :3] = R
+    M[:, :3, 3] = t1 - numpy.einsum('kij,kj->ki', R, t0)
+    M[:, 3, 3] = 1.0
+    return M.reshape(shape + (4, 4))
+
+
+def _horn_coefficients():
+    """Return array mapping covariance matrices to Horn's matrices N.
+
+    The lower triangles of the symmetric matrices N of the quaternion
+    algorithm are numpy.dot(C.reshape(-1, 9), coefficients), where C are
+    the covariance matrices numpy.dot(v0, v1.T).
+
+    """
+    xx, xy, xz, yx, yy, yz, zx, zy, zz = numpy.identity(9).reshape(9, 3, 3)
+    N = numpy.zeros((4, 4, 3, 3))
+    N[0, 0] = xx+yy+zz
+    N[1, 0] = yz-zy
+    N[1, 1] = xx-yy-zz
+    N[2, 0] = zx-xz
+    N[2, 1] = xy+yx
+    N[2, 2] = yy-xx-zz
+    N[3, 0] = xy-yx
+    N[3, 1] = zx+xz
+    N[3, 2] = yz+zy
+    N[3, 3] = zz-xx-yy
+    return N.reshape(16, 9).T.copy()
+
+
+def select_usesvd(npoints, batch=1):
+    """Return True if the SVD algorithm is the faster to register point sets.
+
+    npoints : number of points of each point set
+    batch : number of point sets registered at once by
+        superimposition_matrix_batch, 1 for superimposition_matrix
+
+    The selection uses the nearest entry, in logarithmic scale, of the
+    calibration table measured by calibrate_usesvd. The quaternion
+    algorithm is faster for large batches of point sets only.
+    The algorithm used by the last call with usesvd='auto' is returned by
+    last_usesvd.
+
+    >>> select_usesvd(100)
+    True
+    >>> v0 = numpy.random.rand(3, 10)
+    >>> numpy.allclose(superimposition_matrix(v0, v0, usesvd='auto'),
+    ...                numpy.identity(4))
+    True
+    >>> last_usesvd()
+    True
+    >>> v0 = numpy.random.rand(1000, 3, 100)
+    >>> M = superimposition_matrix_batch(v0, v0, usesvd='auto')
+    >>> numpy.allclose(M, numpy.identity(4))
+    True
+    >>> last_usesvd()
+    False
+
+    """
+    batches, points, ratios = _USESVD_CALIBRATION
+    i = numpy.argmin(numpy.abs(numpy.log(batches) - math.log(max(batch, 1))))
+    j = numpy.argmin(numpy.abs(numpy.log(points) - math.log(max(npoints, 1))))
+    return bool(ratios[i][j] <= 1.0)
+
+
+def _select_usesvd(npoints, batch=1):
+    """Return and record algorithm selected for usesvd='auto'."""
+    global _LAST_USESVD
+    _LAST_USESVD = select_usesvd(npoints, batch)
+    return _LAST_USESVD
+
+
+def last_usesvd():
+    """Return algorithm selected by the last call with usesvd='auto'.
+
+    True for the SVD, False for the quaternion algorithm, None if there was
+    no such call.
+
+    """
+    return _LAST_USESVD
+
+
+def calibrate_usesvd(batches=(1, 10, 100, 1000, 10000),
+                     points=(3, 100, 1000, 10000), number=3, install=True,
+                     maxsize=1000000):
+    """Return and install calibration table of the registration algorithms.
+
+    The run times of the SVD and quaternion algorithms of
+    superimposition_matrix_batch, respectively superimposition_matrix for
+    batches of 1, are measured for all batch sizes and numbers of points.
+    To bound memory, batches are reduced to at most maxsize points in total.
+    Return tuple of batch sizes, numbers of points and ratios of SVD to
+    quaternion run times. If install is True, select_usesvd uses the table.
+
+    >>> table = calibrate_usesvd((1, 2), (3, 10), number=1, install=False)
+    >>> numpy.array(table[2]).shape
+    (2, 2)
+
+    """
+    import timeit
+    ratios = []
+    for batch in batches:
+        row = []
+        for npoints in points:
+            times = []
+            for usesvd in (True, False):
+                if batch == 1:
+                    v0 = numpy.random.rand(3, npoints)
+                    func = superimposition_matrix
+                else:
+                    v0 = numpy.random.rand(
+                        max(1, min(batch, maxsize // npoints)), 3, npoints)
+                    func = superimposition_matrix_batch
+                v1 = numpy.random.rand(*v0.shape)
+                times.append(min(timeit.repeat(
+                    lambda: func(v0, v1, usesvd=usesvd),
+                    number=number, repeat=3)))
+            row.append(round(times[0] / times[1], 2))
+        ratios.append(tuple(row))
+    table = (tuple(batches), tuple(points), tuple(ratios))
+    if install:
+        global _USESVD_CALIBRATION
+        _USESVD_CALIBRATION = table
+    return table
+
+
+def euler_matrix(ai, aj, ak, axes='sxyz', out=None):
     """Return homogeneous rotation matrix from Euler angles and axis sequence.
 
     ai, aj, ak : Euler's roll, pitch and yaw angles
     axes : One of 24 axis sequences as string or encoded tuple
+    out : If given, the matrix is stored there and None is returned
 
     >>> R = euler_matrix(1, 2, 3, 'syxz')
     >>> numpy.allclose(numpy.sum(R[0]), -1.34786452)
@@ -1063,6 +1571,10 @@ def euler_matrix(ai, aj, ak, axes='sxyz'):
     ...    R = euler_matrix(ai, aj, ak, axes)
     >>> for axes in _TUPLE2AXES.keys():
     ...    R = euler_matrix(ai, aj, ak, axes)
+    >>> M = numpy.empty((4, 4))
+    >>> euler_matrix(1, 2, 3, 'syxz', out=M)
+    >>> numpy.allclose(M, euler_matrix(1, 2, 3, 'syxz'))
+    True
 
     """
     try:
@@ -1085,7 +1597,7 @@ def euler_matrix(ai, aj, ak, axes='sxyz'):
     cc, cs = ci*ck, ci*sk
     sc, ss = si*ck, si*sk
 
-    M = numpy.identity(4)
+    M = numpy.identity(4) if out is None else _identity(out)
     if repetition:
         M[i, i] = cj
         M[i, j] = sj*si
@@ -1106,7 +1618,8 @@ def euler_matrix(ai, aj, ak, axes='sxyz'):
         M[k, i] = -sj
         M[k, j] = cj*si
         M[k, k] = cj*ci
-    return M
+    if out is None:
+        return _astype(M)
 
 
 def euler_from_matrix(matrix, axes='sxyz'):
@@ -1232,6 +1745,205 @@ def quaternion_from_euler(ai, aj, ak, axes='sxyz'):
     if parity:
         q[j] *= -1.0
 
+    return _astype(q)
+
+
+def euler_matrix_batch(angles, axes='sxyz', dtype=None):
+    """Return stack of homogeneous rotation matrices from Euler angles.
+
+    angles : array_like of shape (N, 3)
+        Euler's roll, pitch and yaw angles
+    axes : One of 24 axis sequences as string or encoded tuple
+    dtype : float32 or float64, the module precision by default
+
+    The axis sequence is resolved once for the whole batch.
+    Return array of shape (N, 4, 4).
+
+    >>> angles = (4*math.pi) * (numpy.random.random((8, 3)) - 0.5)
+    >>> for axes in _AXES2TUPLE.keys():
+    ...    R = euler_matrix_batch(angles, axes)
+    ...    for a, r in zip(angles, R):
+    ...        if not numpy.allclose(r, euler_matrix(axes=axes, *a)):
+    ...            print(axes, "failed")
+    >>> euler_matrix_batch(angles, (0, 1, 0, 1)).shape
+    (8, 4, 4)
+
+    """
+    firstaxis, parity, repetition, frame = _euler_axes(axes)
+
+    i = firstaxis
+    j = _NEXT_AXIS[i+parity]
+    k = _NEXT_AXIS[i-parity+1]
+
+    angles = numpy.array(angles, dtype=_dtype(dtype), copy=False)
+    if angles.shape[-1:] != (3, ):
+        raise ValueError('angles must be of shape (N, 3)')
+    ai, aj, ak = angles[..., 0], angles[..., 1], angles[..., 2]
+    if frame:
+        ai, ak = ak, ai
+    if parity:
+        ai, aj, ak = -ai, -aj, -ak
+
+    si, sj, sk = numpy.sin(ai), numpy.sin(aj), numpy.sin(ak)
+    ci, cj, ck = numpy.cos(ai), numpy.cos(aj), numpy.cos(ak)
+    cc, cs = ci*ck, ci*sk
+    sc, ss = si*ck, si*sk
+
+    M = numpy.zeros(angles.shape[:-1] + (4, 4), angles.dtype)
+    M[..., 3, 3] = 1.0
+    if repetition:
+        M[..., i, i] = cj
+        M[..., i, j] = sj*si
+        M[..., i, k] = sj*ci
+        M[..., j, i] = sj*sk
+        M[..., j, j] = -cj*ss+cc
+        M[..., j, k] = -cj*cs-sc
+        M[..., k, i] = -sj*ck
+        M[..., k, j] = cj*sc+cs
+        M[..., k, k] = cj*cc-ss
+    else:
+        M[..., i, i] = cj*ck
+        M[..., i, j] = sj*sc-cs
+        M[..., i, k] = sj*cc+ss
+        M[..., j, i] = cj*sk
+        M[..., j, j] = sj*ss+cc
+        M[..., j, k] = sj*cs-sc
+        M[..., k, i] = -sj
+        M[..., k, j] = cj*si
+        M[..., k, k] = cj*ci
+    return M
+
+
+def euler_from_matrix_batch(matrices, axes='sxyz'):
+    """Return Euler angles from stack of rotation matrices.
+
+    matrices : array_like of shape (N, 4, 4) or (N, 3, 3)
+    axes : One of 24 axis sequences as string or encoded tuple
+
+    The gimbal lock cases are handled as in euler_from_matrix.
+    Return array of shape (N, 3).
+
+    >>> angles = (4*math.pi) * (numpy.random.random((8, 3)) - 0.5)
+    >>> for axes in _AXES2TUPLE.keys():
+    ...    R0 = euler_matrix_batch(angles, axes)
+    ...    R1 = euler_matrix_batch(euler_from_matrix_batch(R0, axes), axes)
+    ...    if not numpy.allclose(R0, R1): print(axes, "failed")
+    >>> R = euler_matrix_batch([[0.1, 0.0, 0.3], [0.1, math.pi/2, 0.3]], 'rzxz')
+    >>> for r, a in zip(R, euler_from_matrix_batch(R, 'rzxz')):
+    ...    if not numpy.allclose(a, euler_from_matrix(r, 'rzxz')): print(a)
+
+    """
+    firstaxis, parity, repetition, frame = _euler_axes(axes)
+
+    i = firstaxis
+    j = _NEXT_AXIS[i+parity]
+    k = _NEXT_AXIS[i-parity+1]
+
+    M = numpy.array(matrices, dtype=numpy.float64, copy=False)[..., :3, :3]
+    if repetition:
+        sy = numpy.sqrt(M[..., i, j]*M[..., i, j] + M[..., i, k]*M[..., i, k])
+        regular = sy > _EPS
+        ax = numpy.where(regular,
+                         numpy.arctan2( M[..., i, j],  M[..., i, k]),
+                         numpy.arctan2(-M[..., j, k],  M[..., j, j]))
+        ay = numpy.arctan2( sy,       M[..., i, i])
+        az = numpy.where(regular,
+                         numpy.arctan2( M[..., j, i], -M[..., k, i]), 0.0)
+    else:
+        cy = numpy.sqrt(M[..., i, i]*M[..., i, i] + M[..., j, i]*M[..., j, i])
+        regular = cy > _EPS
+        ax = numpy.where(regular,
+                         numpy.arctan2( M[..., k, j],  M[..., k, k]),
+                         numpy.arctan2(-M[..., j, k],  M[..., j, j]))
+        ay = numpy.arctan2(-M[..., k, i],  cy)
+        az = numpy.where(regular,
+                         numpy.arctan2( M[..., j, i],  M[..., i, i]), 0.0)
+
+    if parity:
+        ax, ay, az = -ax, -ay, -az
+    if frame:
+        ax, az = az, ax
+    return numpy.stack((ax, ay, az), axis=-1)
+
+
+def euler_from_quaternion_batch(quaternions, axes='sxyz'):
+    """Return Euler angles from stack of quaternions.
+
+    Return array of shape (N, 3).
+
+    >>> angles = euler_from_quaternion_batch([[0.99810947, 0.06146124, 0, 0]])
+    >>> numpy.allclose(angles, [[0.123, 0, 0]])
+    True
+
+    """
+    return euler_from_matrix_batch(quaternion_matrix_batch(quaternions),
+                                   axes)
+
+
+def quaternion_from_euler_batch(angles, axes='sxyz', dtype=None):
+    """Return stack of quaternions from Euler angles and axis sequence.
+
+    angles : array_like of shape (N, 3)
+        Euler's roll, pitch and yaw angles
+    axes : One of 24 axis sequences as string or encoded tuple
+    dtype : float32 or float64, the module precision by default
+
+    Return array of shape (N, 4).
+
+    >>> q = quaternion_from_euler_batch([[1, 2, 3]], 'ryxz')
+    >>> numpy.allclose(q, [[0.435953, 0.310622, -0.718287, 0.444435]])
+    True
+    >>> angles = (4*math.pi) * (numpy.random.random((8, 3)) - 0.5)
+    >>> for axes in _AXES2TUPLE.keys():
+    ...    q = quaternion_from_euler_batch(angles, axes)
+    ...    for a, qa in zip(angles, q):
+    ...        if not numpy.allclose(qa, quaternion_from_euler(axes=axes, *a)):
+    ...            print(axes, "failed")
+
+    """
+    firstaxis, parity, repetition, frame = _euler_axes(axes)
+
+    i = firstaxis + 1
+    j = _NEXT_AXIS[i+parity-1] + 1
+    k = _NEXT_AXIS[i-parity] + 1
+
+    angles = numpy.array(angles, dtype=_dtype(dtype), copy=False)
+    if angles.shape[-1:] != (3, ):
+        raise ValueError('angles must be of shape (N, 3)')
+    ai, aj, ak = angles[..., 0], angles[..., 1], angles[..., 2]
+    if frame:
+        ai, ak = ak, ai
+    if parity:
+        aj = -aj
+
+    ai = ai / 2.0
+    aj = aj / 2.0
+    ak = ak / 2.0
+    ci = numpy.cos(ai)
+    si = numpy.sin(ai)
+    cj = numpy.cos(aj)
+    sj = numpy.sin(aj)
+    ck = numpy.cos(ak)
+    sk = numpy.sin(ak)
+    cc = ci*ck
+    cs = ci*sk
+    sc = si*ck
+    ss = si*sk
+
+    q = numpy.empty(angles.shape[:-1] + (4, ), angles.dtype)
+    if repetition:
+        q[..., 0] = cj*(cc - ss)
+        q[..., i] = cj*(cs + sc)
+        q[..., j] = sj*(cc + ss)
+        q[..., k] = sj*(cs - sc)
+    else:
+        q[..., 0] = cj*cc + sj*ss
+        q[..., i] = cj*sc - sj*cs
+        q[..., j] = cj*ss + sj*cc
+        q[..., k] = cj*cs - sj*sc
+    if parity:
+        q[..., j] *= -1.0
+
     return q
 
 
@@ -1248,12 +1960,14 @@ def quaternion_about_axis(angle, axis):
     if qlen > _EPS:
         q *= math.sin(angle/2.0) / qlen
     q[0] = math.cos(angle/2.0)
-    return q
+    return _astype(q)
 
 
-def quaternion_matrix(quaternion):
+def quaternion_matrix(quaternion, out=None):
     """Return homogeneous rotation matrix from quaternion.
 
+    If out is given, the matrix is stored there and None is returned.
+
     >>> M = quaternion_matrix([0.99810947, 0.06146124, 0, 0])
     >>> numpy.allclose(M, rotation_matrix(0.123, [1, 0, 0]))
     True
@@ -1263,19 +1977,69 @@ def quaternion_matrix(quaternion):
     >>> M = quaternion_matrix([0, 1, 0, 0])
     >>> numpy.allclose(M, numpy.diag([1, -1, -1, 1]))
     True
+    >>> quaternion_matrix([0.99810947, 0.06146124, 0, 0], out=M)
+    >>> numpy.allclose(M, rotation_matrix(0.123, [1, 0, 0]))
+    True
 
     """
-    q = numpy.array(quaternion, dtype=numpy.float64, copy=True)
-    n = numpy.dot(q, q)
+    w, x, y, z = (float(quaternion[0]), float(quaternion[1]),
+                  float(quaternion[2]), float(quaternion[3]))
+    n = w*w + x*x + y*y + z*z
     if n < _EPS:
-        return numpy.identity(4)
-    q *= math.sqrt(2.0 / n)
-    q = numpy.outer(q, q)
-    return numpy.array([
-        [1.0-q[2, 2]-q[3, 3],     q[1, 2]-q[3, 0],     q[1, 3]+q[2, 0], 0.0],
-        [    q[1, 2]+q[3, 0], 1.0-q[1, 1]-q[3, 3],     q[2, 3]-q[1, 0], 0.0],
-        [    q[1, 3]-q[2, 0],     q[2, 3]+q[1, 0], 1.0-q[1, 1]-q[2, 2], 0.0],
-        [                0.0,                 0.0,                 0.0, 1.0]])
+        if out is None:
+            return numpy.identity(4, _PRECISION)
+        _identity(out)
+        return
+    n = 2.0 / n
+    ww, wx, wy, wz = n*w*w, n*w*x, n*w*y, n*w*z
+    xx, xy, xz = n*x*x, n*x*y, n*x*z
+    yy, yz, zz = n*y*y, n*y*z, n*z*z
+    return _matrix(((1.0-yy-zz,     xy-wz,     xz+wy, 0.0),
+                    (    xy+wz, 1.0-xx-zz,     yz-wx, 0.0),
+                    (    xz-wy,     yz+wx, 1.0-xx-yy, 0.0),
+                    (      0.0,       0.0,       0.0, 1.0)), out)
+
+
+def quaternion_matrix_batch(quaternions, dtype=None):
+    """Return stack of homogeneous rotation matrices from quaternions.
+
+    quaternions : array_like of shape (N, 4)
+    dtype : float32 or float64, the module precision by default
+
+    Quaternions of near zero length map to the identity matrix.
+    Return array of shape (N, 4, 4).
+
+    >>> M = quaternion_matrix_batch([[0.99810947, 0.06146124, 0, 0],
+    ...                              [1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 0, 0]])
+    >>> numpy.allclose(M[0], rotation_matrix(0.123, [1, 0, 0]))
+    True
+    >>> numpy.allclose(M[1], numpy.identity(4))
+    True
+    >>> numpy.allclose(M[2], numpy.diag([1, -1, -1, 1]))
+    True
+    >>> numpy.allclose(M[3], numpy.identity(4))
+    True
+
+    """
+    q = numpy.array(quaternions, dtype=_dtype(dtype), copy=True)
+    n = numpy.sum(q * q, axis=-1)
+    degenerate = n < _EPS
+    n = numpy.where(degenerate, 0.0,
+                    numpy.sqrt(2.0 / numpy.where(degenerate, 2.0, n)))
+    q *= n[..., numpy.newaxis]
+    q = q[..., :, numpy.newaxis] * q[..., numpy.newaxis, :]
+    M = numpy.zeros(q.shape[:-2] + (4, 4), q.dtype)
+    M[..., 0, 0] = 1.0 - q[..., 2, 2] - q[..., 3, 3]
+    M[..., 0, 1] = q[..., 1, 2] - q[..., 3, 0]
+    M[..., 0, 2] = q[..., 1, 3] + q[..., 2, 0]
+    M[..., 1, 0] = q[..., 1, 2] + q[..., 3, 0]
+    M[..., 1, 1] = 1.0 - q[..., 1, 1] - q[..., 3, 3]
+    M[..., 1, 2] = q[..., 2, 3] - q[..., 1, 0]
+    M[..., 2, 0] = q[..., 1, 3] - q[..., 2, 0]
+    M[..., 2, 1] = q[..., 2, 3] + q[..., 1, 0]
+    M[..., 2, 2] = 1.0 - q[..., 1, 1] - q[..., 2, 2]
+    M[..., 3, 3] = 1.0
+    return M
 
 
 def quaternion_from_matrix(matrix, isprecise=False):
@@ -1360,72 +2124,221 @@ def quaternion_from_matrix(matrix, isprecise=False):
         q = V[[3, 0, 1, 2], numpy.argmax(w)]
     if q[0] < 0.0:
         numpy.negative(q, q)
-    return q
+    return _astype(q)
+
+
+def quaternion_from_matrix_batch(matrices, isprecise=False):
+    """Return stack of quaternions from stack of rotation matrices.
+
+    matrices : array_like of shape (N, 4, 4)
+
+    If isprecise is True, the input matrices are assumed to be precise
+    rotation matrices and the faster algorithm is used, with the branch of
+    quaternion_from_matrix selected per matrix. Otherwise the eigenvectors
+    of all K matrices are computed in one call.
+    Signs follow quaternion_from_matrix, i.e. the real parts are positive.
+    Return array of shape (N, 4).
+
+    >>> R = [numpy.identity(4), numpy.diag([1, -1, -1, 1]),
+    ...      rotation_matrix(0.123, (1, 2, 3)), euler_matrix(0, 0, math.pi/2)]
+    >>> R += [random_rotation_matrix() for _ in range(4)]
+    >>> q0 = quaternion_from_matrix_batch(R, isprecise=True)
+    >>> q1 = quaternion_from_matrix_batch(R, isprecise=False)
+    >>> numpy.allclose(q0[2], [0.9981095, 0.0164262, 0.0328524, 0.0492786])
+    True
+    >>> all(is_same_quaternion(a, b) for a, b in zip(q0, q1))
+    True
+    >>> all(numpy.allclose(q, quaternion_from_matrix(r, True))
+    ...     for q, r in zip(q0, R))
+    True
+    >>> all(numpy.allclose(q, quaternion_from_matrix(r)) for q, r in zip(q1, R))
+    True
+    >>> numpy.allclose(quaternion_matrix_batch(q1), R)
+    True
+
+    """
+    M = numpy.array(matrices, dtype=numpy.float64, copy=False)[..., :4, :4]
+    shape = M.shape[:-2]
+    M = M.reshape(-1, 4, 4)
+    index = numpy.arange(M.shape[0])
+    if isprecise:
+        # candidate quaternions for each branch of quaternion_from_matrix
+        Q = numpy.empty((M.shape[0], 4, 4))
+        T = numpy.empty((M.shape[0], 4))
+        for i, j, k in ((0, 1, 2), (1, 2, 0), (2, 0, 1)):
+            T[:, i] = M[:, i, i] - (M[:, j, j] + M[:, k, k]) + M[:, 3, 3]
+            Q[:, i, 0] = M[:, k, j] - M[:, j, k]
+            Q[:, i, i+1] = T[:, i]
+            Q[:, i, j+1] = M[:, i, j] + M[:, j, i]
+            Q[:, i, k+1] = M[:, k, i] + M[:, i, k]
+        T[:, 3] = numpy.trace(M, axis1=1, axis2=2)
+        Q[:, 3, 0] = T[:, 3]
+        Q[:, 3, 3] = M[:, 1, 0] - M[:, 0, 1]
+        Q[:, 3, 2] = M[:, 0, 2] - M[:, 2, 0]
+        Q[:, 3, 1] = M[:, 2, 1] - M[:, 1, 2]
+        select = numpy.where(T[:, 3] > M[:, 3, 3], 3, numpy.argmax(
+            numpy.diagonal(M[:, :3, :3], axis1=1, axis2=2), axis=1))
+        q = Q[index, select]
+        q *= (0.5 / numpy.sqrt(T[index, select] * M[:, 3, 3]))[:, numpy.newaxis]
+    else:
+        m00 = M[:, 0, 0]
+        m01 = M[:, 0, 1]
+        m02 = M[:, 0, 2]
+        m10 = M[:, 1, 0]
+        m11 = M[:, 1, 1]
+        m12 = M[:, 1, 2]
+        m20 = M[:, 2, 0]
+        m21 = M[:, 2, 1]
+        m22 = M[:, 2, 2]
+        # symmetric matrices K, lower triangles only
+        K = numpy.zeros((M.shape[0], 4, 4))
+        K[:, 0, 0] = m00-m11-m22
+        K[:, 1, 0] = m01+m10
+        K[:, 1, 1] = m11-m00-m22
+        K[:, 2, 0] = m02+m20
+        K[:, 2, 1] = m12+m21
+        K[:, 2, 2] = m22-m00-m11
+        K[:, 3, 0] = m21-m12
+        K[:, 3, 1] = m02-m20
+        K[:, 3, 2] = m10-m01
+        K[:, 3, 3] = m00+m11+m22
+        K /= 3.0
+        # quaternions are eigenvectors corresponding to largest eigenvalues
+        w, V = numpy.linalg.eigh(K)
+        q = V[index[:, numpy.newaxis], [3, 0, 1, 2],
+              numpy.argmax(w, axis=1)[:, numpy.newaxis]]
+    numpy.negative(q, out=q, where=(q[:, :1] < 0.0))
+    return _astype(q.reshape(shape + (4, )))
 
 
-def quaternion_multiply(quaternion1, quaternion0):
+def quaternion_multiply(quaternion1, quaternion0, out=None):
     """Return multiplication of two quaternions.
 
+    The quaternions may be arrays of shape (\*, 4), which are broadcast
+    against each other. If out is given, the result is stored there
+    and None is returned.
+
     >>> q = quaternion_multiply([4, 1, -2, 3], [8, -5, 6, 7])
     >>> numpy.allclose(q, [28, -44, -14, 48])
     True
+    >>> q0 = numpy.array([[4, 1, -2, 3], [1, 0, 0, 0]], dtype=numpy.float64)
+    >>> q = quaternion_multiply(q0, [8, -5, 6, 7])
+    >>> numpy.allclose(q, [[28, -44, -14, 48], [8, -5, 6, 7]])
+    True
+    >>> quaternion_multiply(q0, q0[::-1], out=q0)
+    >>> numpy.allclose(q0, [[4, 1, -2, 3], [4, 1, -2, 3]])
+    True
 
     """
-    w0, x0, y0, z0 = quaternion0
-    w1, x1, y1, z1 = quaternion1
-    return numpy.array([
-        -x1*x0 - y1*y0 - z1*z0 + w1*w0,
-        x1*w0 + y1*z0 - z1*y0 + w1*x0,
-        -x1*z0 + y1*w0 + z1*x0 + w1*y0,
-        x1*y0 - y1*x0 + z1*w0 + w1*z0], dtype=numpy.float64)
+    q0 = numpy.array(quaternion0, dtype=_PRECISION, copy=False)
+    q1 = numpy.array(quaternion1, dtype=_PRECISION, copy=False)
+    w0, x0, y0, z0 = q0[..., 0], q0[..., 1], q0[..., 2], q0[..., 3]
+    w1, x1, y1, z1 = q1[..., 0], q1[..., 1], q1[..., 2], q1[..., 3]
+    w = -x1*x0 - y1*y0 - z1*z0 + w1*w0
+    x = x1*w0 + y1*z0 - z1*y0 + w1*x0
+    y = -x1*z0 + y1*w0 + z1*x0 + w1*y0
+    z = x1*y0 - y1*x0 + z1*w0 + w1*z0
+    if out is None:
+        return numpy.stack((w, x, y, z), axis=-1)
+    out[..., 0] = w
+    out[..., 1] = x
+    out[..., 2] = y
+    out[..., 3] = z
 
 
-def quaternion_conjugate(quaternion):
+def quaternion_conjugate(quaternion, out=None):
     """Return conjugate of quaternion.
 
+    The quaternion may be an array of shape (\*, 4).
+    If out is given, the result is stored there and None is returned.
+
     >>> q0 = random_quaternion()
     >>> q1 = quaternion_conjugate(q0)
     >>> q1[0] == q0[0] and all(q1[1:] == -q0[1:])
     True
+    >>> q0 = numpy.random.random((5, 4))
+    >>> q1 = numpy.empty((5, 4))
+    >>> quaternion_conjugate(q0, out=q1)
+    >>> all(q1[:, 0] == q0[:, 0]) and numpy.all(q1[:, 1:] == -q0[:, 1:])
+    True
 
     """
-    q = numpy.array(quaternion, dtype=numpy.float64, copy=True)
-    numpy.negative(q[1:], q[1:])
-    return q
+    if out is None:
+        q = numpy.array(quaternion, dtype=_PRECISION, copy=True)
+        numpy.negative(q[..., 1:], q[..., 1:])
+        return q
+    q = numpy.array(quaternion, copy=False)
+    out[..., 0] = q[..., 0]
+    numpy.negative(q[..., 1:], out[..., 1:])
 
 
-def quaternion_inverse(quaternion):
+def quaternion_inverse(quaternion, out=None):
     """Return inverse of quaternion.
 
+    The quaternion may be an array of shape (\*, 4).
+    If out is given, the result is stored there and None is returned.
+
     >>> q0 = random_quaternion()
     >>> q1 = quaternion_inverse(q0)
     >>> numpy.allclose(quaternion_multiply(q0, q1), [1, 0, 0, 0])
     True
+    >>> q0 = numpy.random.random((5, 4))
+    >>> q1 = numpy.empty((5, 4))
+    >>> quaternion_inverse(q0, out=q1)
+    >>> numpy.allclose(quaternion_multiply(q0, q1), [1, 0, 0, 0])
+    True
 
     """
-    q = numpy.array(quaternion, dtype=numpy.float64, copy=True)
-    numpy.negative(q[1:], q[1:])
-    return q / numpy.dot(q, q)
+    q = numpy.array(quaternion, dtype=_PRECISION, copy=False)
+    n = numpy.sum(q * q, axis=-1)[..., numpy.newaxis]
+    if out is None:
+        q = q.copy()
+        numpy.negative(q[..., 1:], q[..., 1:])
+        q /= n
+        return q
+    out[..., 0] = q[..., 0]
+    numpy.negative(q[..., 1:], out[..., 1:])
+    out /= n
 
 
-def quaternion_real(quaternion):
+def quaternion_real(quaternion, out=None):
     """Return real part of quaternion.
 
+    For arrays of quaternions of shape (\*, 4), an array of shape (\*) is
+    returned, or stored in out.
+
     >>> quaternion_real([3, 0, 1, 2])
     3.0
+    >>> quaternion_real([[3, 0, 1, 2], [4, 0, 1, 2]])
+    array([ 3.,  4.])
 
     """
-    return float(quaternion[0])
+    q = numpy.array(quaternion, dtype=_PRECISION, copy=False)
+    if out is not None:
+        out[...] = q[..., 0]
+    elif q.ndim == 1:
+        return float(q[0])
+    else:
+        return q[..., 0].copy()
 
 
-def quaternion_imag(quaternion):
+def quaternion_imag(quaternion, out=None):
     """Return imaginary part of quaternion.
 
+    For arrays of quaternions of shape (\*, 4), an array of shape (\*, 3) is
+    returned, or stored in out.
+
     >>> quaternion_imag([3, 0, 1, 2])
     array([ 0.,  1.,  2.])
+    >>> quaternion_imag([[3, 0, 1, 2], [4, 0, 2, 1]])
+    array([[ 0.,  1.,  2.],
+           [ 0.,  2.,  1.]])
 
     """
-    return numpy.array(quaternion[1:4], dtype=numpy.float64, copy=True)
+    q = numpy.array(quaternion, dtype=_PRECISION, copy=False)
+    if out is None:
+        return q[..., 1:4].copy()
+    out[...] = q[..., 1:4]
 
 
 def quaternion_slerp(quat0, quat1, fraction, spin=0, shortestpath=True):
@@ -1449,24 +2362,97 @@ def quaternion_slerp(quat0, quat1, fraction, spin=0, shortestpath=True):
     q0 = unit_vector(quat0[:4])
     q1 = unit_vector(quat1[:4])
     if fraction == 0.0:
-        return q0
+        return _astype(q0)
     elif fraction == 1.0:
-        return q1
+        return _astype(q1)
     d = numpy.dot(q0, q1)
     if abs(abs(d) - 1.0) < _EPS:
-        return q0
+        return _astype(q0)
     if shortestpath and d < 0.0:
         # invert rotation
         d = -d
         numpy.negative(q1, q1)
     angle = math.acos(d) + spin * math.pi
     if abs(angle) < _EPS:
-        return q0
+        return _astype(q0)
     isin = 1.0 / math.sin(angle)
     q0 *= math.sin((1.0 - fraction) * angle) * isin
     q1 *= math.sin(fraction * angle) * isin
     q0 += q1
-    return q0
+    return _astype(q0)
+
+
+def quaternion_slerp_batch(quat0, quat1, fraction, spin=0,
+                           shortestpath=True, dtype=None):
+    """Return spherical linear interpolations between pairs of quaternions.
+
+    quat0, quat1 : array_like of shape (N, 4)
+        Start and end quaternions
+    fraction : array_like of shape (F, )
+        Interpolation fractions, applied to every pair
+    dtype : float32 or float64, the module precision by default
+
+    The semantics of spin, shortestpath and the degenerate cases are those
+    of quaternion_slerp.
+    Return array of shape (N, F, 4).
+
+    >>> q0 = numpy.array([random_quaternion() for _ in range(3)])
+    >>> q1 = numpy.array([random_quaternion() for _ in range(3)])
+    >>> q1[2] = q0[2]
+    >>> fractions = [0.0, 0.25, 0.5, 1.0, 2.0]
+    >>> q = quaternion_slerp_batch(q0, q1, fractions)
+    >>> q.shape
+    (3, 5, 4)
+    >>> all(numpy.allclose(q[n, f], quaternion_slerp(q0[n], q1[n], fraction))
+    ...     for n in range(3) for f, fraction in enumerate(fractions))
+    True
+    >>> q = quaternion_slerp_batch(q0, q1, fractions, spin=1,
+    ...                            shortestpath=False)
+    >>> all(numpy.allclose(q[n, f], quaternion_slerp(q0[n], q1[n], fraction,
+    ...                                              1, False))
+    ...     for n in range(3) for f, fraction in enumerate(fractions))
+    True
+
+    """
+    dtype = _dtype(dtype)
+    eps = numpy.finfo(dtype).eps * 4.0
+    q0 = numpy.array(quat0, dtype=dtype, copy=False)[..., :4]
+    q1 = numpy.array(quat1, dtype=dtype, copy=False)[..., :4]
+    q0 = q0 / numpy.sqrt(numpy.sum(q0 * q0, axis=-1))[..., numpy.newaxis]
+    q1 = q1 / numpy.sqrt(numpy.sum(q1 * q1, axis=-1))[..., numpy.newaxis]
+    q0, q1 = numpy.broadcast_arrays(q0, q1)
+    fraction = numpy.array(fraction, dtype=dtype, copy=False)
+    d = numpy.sum(q0 * q1, axis=-1)
+    degenerate = numpy.abs(numpy.abs(d) - 1.0) < eps
+    if shortestpath:
+        # invert rotations
+        invert = d < 0.0
+        d = numpy.where(invert, -d, d)
+        q = numpy.where(invert[..., numpy.newaxis], -q1, q1)
+    else:
+        q = q1
+    angle = numpy.arccos(numpy.clip(d, -1.0, 1.0)) + spin * math.pi
+    degenerate |= numpy.abs(angle) < eps
+    isin = 1.0 / numpy.sin(numpy.where(degenerate, 1.0, angle))
+
+    # expand to shape (N, F) for scalars and (N, F, 4) for quaternions
+    ndim = fraction.ndim
+    shape = angle.shape + (1, ) * ndim
+    angle = angle.reshape(shape)
+    isin = isin.reshape(shape)
+    degenerate = degenerate.reshape(shape)
+    shape = q0.shape[:-1] + (1, ) * ndim + (4, )
+    q0 = q0.reshape(shape)
+    q1 = q1.reshape(shape)
+    q = q.reshape(shape)
+
+    s0 = numpy.sin((1.0 - fraction) * angle) * isin
+    s1 = numpy.sin(fraction * angle) * isin
+    result = q0 * s0[..., numpy.newaxis] + q * s1[..., numpy.newaxis]
+    result = numpy.where(degenerate[..., numpy.newaxis], q0, result)
+    result = numpy.where((fraction == 1.0)[..., numpy.newaxis], q1, result)
+    result = numpy.where((fraction == 0.0)[..., numpy.newaxis], q0, result)
+    return _astype(result, dtype)
 
 
 def random_quaternion(rand=None):
@@ -1494,7 +2480,7 @@ def random_quaternion(rand=None):
     t1 = pi2 * rand[1]
     t2 = pi2 * rand[2]
     return numpy.array([numpy.cos(t2)*r2, numpy.sin(t1)*r1,
-                        numpy.cos(t1)*r1, numpy.sin(t2)*r2])
+                        numpy.cos(t1)*r1, numpy.sin(t2)*r2], _PRECISION)
 
 
 def random_rotation_matrix(rand=None):
@@ -1684,6 +2670,119 @@ _AXES2TUPLE = {
 
 _TUPLE2AXES = dict((v, k) for k, v in _AXES2TUPLE.items())
 
+_HORN_COEFFICIENTS = _horn_coefficients()
+
+# run time ratios of SVD and quaternion registration algorithms measured by
+# calibrate_usesvd for batch sizes (rows) and numbers of points (columns)
+_USESVD_CALIBRATION = ((1, 10, 100, 1000, 10000),
+                       (3, 100, 1000, 10000),
+                       ((0.56, 0.58, 0.57, 0.43),
+                        (0.92, 0.95, 0.97, 1.01),
+                        (0.97, 1.08, 1.67, 0.97),
+                        (0.90, 1.12, 1.04, 0.79),
+                        (0.97, 1.12, 0.84, 1.03)))
+
+# algorithm selected by the last call with usesvd='auto', see last_usesvd
+_LAST_USESVD = None
+
+
+def _euler_axes(axes):
+    """Return inner axis, parity, repetition and frame of axis sequence."""
+    try:
+        return _AXES2TUPLE[axes.lower()]
+    except (AttributeError, KeyError):
+        _TUPLE2AXES[axes]  # validation
+        return tuple(axes)
+
+
+# floating point type of arrays returned by constructors, see set_precision
+_PRECISION = numpy.dtype(numpy.float64)
+
+
+def get_precision():
+    """Return floating point type of arrays returned by constructors."""
+    return _PRECISION
+
+
+def set_precision(dtype):
+    """Set floating point type of arrays returned by constructors.
+
+    dtype : numpy.float64 (default) or numpy.float32
+
+    Return the previous floating point type. The setting is global, not
+    per thread. See the precision context manager.
+
+    """
+    global _PRECISION
+    dtype = numpy.dtype(dtype)
+    if dtype not in (numpy.float32, numpy.float64):
+        raise ValueError('precision must be float32 or float64')
+    previous = _PRECISION
+    _PRECISION = dtype
+    return previous
+
+
+@contextlib.contextmanager
+def precision(dtype):
+    """Return context manager setting floating point type of constructors.
+
+    >>> with precision(numpy.float32):
+    ...     M = translation_matrix([1, 2, 3])
+    ...     R = rotation_matrix([0.1, 0.2], [0, 0, 1])
+    >>> M.dtype, R.dtype
+    (dtype('float32'), dtype('float32'))
+    >>> translation_matrix([1, 2, 3]).dtype
+    dtype('float64')
+
+    """
+    previous = set_precision(dtype)
+    try:
+        yield
+    finally:
+        set_precision(previous)
+
+
+def _dtype(dtype=None):
+    """Return dtype, or the module precision if dtype is None."""
+    return _PRECISION if dtype is None else numpy.dtype(dtype)
+
+
+def _astype(M, dtype=None):
+    """Return array in dtype, or in the module precision if dtype is None."""
+    dtype = _PRECISION if dtype is None else numpy.dtype(dtype)
+    return M if M.dtype == dtype else M.astype(dtype)
+
+
+def _matrix(rows, out=None):
+    """Return 4x4 matrix from nested sequence in the module precision.
+
+    If out is given, the numbers are stored there and None is returned.
+
+    """
+    if out is None:
+        return numpy.array(rows, _PRECISION)
+    out[...] = rows
+
+
+def _ndim(a):
+    """Return number of dimensions of number, array, or nested sequence.
+
+    Unlike numpy.ndim, no array is created for numbers and arrays.
+
+    """
+    if isinstance(a, (int, float)):
+        return 0
+    ndim = getattr(a, 'ndim', None)
+    return numpy.ndim(a) if ndim is None else ndim
+
+
+def _identity(out):
+    """Set square matrix out to identity matrix and return it."""
+    out.fill(0.0)
+    for i in range(out.shape[0]):
+        out[i, i] = 1.0
+    return out
+
 
 def vector_norm(data, axis=None, out=None):
     """Return length, i.e. Euclidean norm, of ndarray along axis.
@@ -1865,7 +2964,100 @@ def concatenate_matrices(*matrices):
     M = numpy.identity(4)
     for i in matrices:
         M = numpy.dot(M, i)
-    return M
+    return _astype(M)
+
+
+def concatenate_matrices_into(out, matrices, work=None):
+    """Store concatenation of sequence of transformation matrices in out.
+
+    The products are computed in out and the work buffer of the shape and
+    type of out, alternately, such that no temporary arrays are allocated
+    if work is given and the matrices are arrays of the type of out.
+    None is returned.
+
+    >>> M = numpy.random.rand(3, 4, 4) - 0.5
+    >>> out, work = numpy.empty((4, 4)), numpy.empty((4, 4))
+    >>> for n in range(4):
+    ...     concatenate_matrices_into(out, M[:n], work)
+    ...     if not numpy.allclose(out, concatenate_matrices(*M[:n])):
+    ...         print(n, "failed")
+
+    """
+    n = len(matrices)
+    if n == 0:
+        _identity(out)
+        return
+    if n == 1:
+        out[...] = matrices[0]
+        return
+    if work is None:
+        work = numpy.empty_like(out)
+    # numpy.dot does not allocate but requires arrays of the type of out
+    product = numpy.dot
+    if not (out.flags['C_CONTIGUOUS'] and work.flags['C_CONTIGUOUS']):
+        product = numpy.matmul
+    for M in matrices:
+        if not isinstance(M, numpy.ndarray) or M.dtype != out.dtype:
+            product = numpy.matmul
+    M = matrices[0]
+    for k in range(1, n):
+        # the last product is stored in out
+        target = out if (n - 1 - k) % 2 == 0 else work
+        product(M, matrices[k], out=target)
+        M = target
+
+
+def benchmark_allocations(number=1000):
+    """Return memory allocated by constructors with and without out buffers.
+
+    The memory traced by tracemalloc is sampled around each of number calls
+    of translation_matrix, rotation_matrix, scale_matrix, quaternion_matrix,
+    euler_matrix, and concatenate_matrices, respectively of the same
+    functions storing their results in preallocated buffers.
+    Return list of (function name, bytes per call without out, bytes per
+    call with out) tuples. Bytes per call are the mean peak of the memory
+    allocated during a call. Requires Python 3.9.
+
+    >>> for name, fresh, reused in benchmark_allocations(10):
+    ...     if reused >= fresh: print(name, fresh, reused)
+
+    """
+    import tracemalloc
+    v = numpy.random.random(3) - 0.5
+    q = random_quaternion()
+    M = [random_rotation_matrix() for _ in range(4)]
+    out = numpy.empty((4, 4), _PRECISION)
+    work = numpy.empty((4, 4), _PRECISION)
+    cases = (
+        ('translation_matrix', lambda: translation_matrix(v),
+         lambda: translation_matrix(v, out=out)),
+        ('rotation_matrix', lambda: rotation_matrix(0.5, v, v),
+         lambda: rotation_matrix(0.5, v, v, out=out)),
+        ('scale_matrix', lambda: scale_matrix(1.5, v),
+         lambda: scale_matrix(1.5, v, out=out)),
+        ('quaternion_matrix', lambda: quaternion_matrix(q),
+         lambda: quaternion_matrix(q, out=out)),
+        ('euler_matrix', lambda: euler_matrix(0.1, 0.2, 0.3),
+         lambda: euler_matrix(0.1, 0.2, 0.3, out=out)),
+        ('concatenate_matrices', lambda: concatenate_matrices(*M),
+         lambda: concatenate_matrices_into(out, M, work)))
+
+    def allocated(func):
+        func()  # warm up caches
+        total = 0
+        tracemalloc.start()
+        try:
+            for _ in range(number):
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+                func()
+                total += tracemalloc.get_traced_memory()[1] - before
+        finally:
+            tracemalloc.stop()
+        return total / number
+
+    return [(name, allocated(fresh), allocated(reused))
+            for name, fresh, reused in cases]
 
 
 def is_same_transform(matrix0, matrix1):
@@ -1891,39 +3083,575 @@ def is_same_quaternion(q0, q1):
     return numpy.allclose(q0, q1) or numpy.allclose(q0, -q1)
 
 
-def _import_module(name, package=None, warn=True, prefix='_py_', ignore='_'):
-    """Try import all public attributes from module into global namespace.
+# Backend registry
+#
+# A backend is a named set of implementations of public functions of this
+# module. The 'numpy' backend holds the pure Python and NumPy reference
+# implementations defined above. Accelerated backends override individual
+# module globals when activated; the reference implementations remain
+# available from the registry.
+
+_REFERENCE_BACKEND = 'numpy'
+
+_BACKENDS = {
+    _REFERENCE_BACKEND: dict(
+        (name, func) for name, func in globals().items()
+        if not name.startswith('_') and callable(func) and
+        getattr(func, '__module__', None) == __name__)}
+
+_ACTIVE_BACKEND = dict((name, _REFERENCE_BACKEND)
+                       for name in _BACKENDS[_REFERENCE_BACKEND])
+
+# functions whose reference implementations accept stacks of inputs or out
+# arguments. Scalar accelerated implementations of these functions are not
+# activated by default.
+_BATCHED_FUNCTIONS = frozenset((
+    'rotation_matrix', 'quaternion_multiply', 'quaternion_conjugate',
+    'quaternion_inverse', 'quaternion_real', 'quaternion_imag',
+    'translation_matrix', 'scale_matrix', 'euler_matrix',
+    'quaternion_matrix'))
+
+
+def register_backend(name, functions, activate=False):
+    """Register implementations of module functions under backend name.
+
+    functions : dict of function names to callables. Only functions with a
+        reference implementation in this module can be registered.
+        Alternatively a callable returning such dict, which is called when
+        the backend is first used, e.g. to defer importing a JIT compiler.
+    activate : If True, activate all registered functions of the backend.
+        If 'default', activate those that do not shadow batched reference
+        implementations.
+
+    >>> register_backend('example', {'identity_matrix': identity_matrix})
+    >>> 'example' in list_backends()
+    True
+    >>> unregister_backend('example')
+    >>> register_backend('lazy', lambda: {'identity_matrix': identity_matrix})
+    >>> callable(_BACKENDS['lazy'])
+    True
+    >>> backend_functions('lazy')
+    ['identity_matrix']
+    >>> unregister_backend('lazy')
+
+    """
+    if name == _REFERENCE_BACKEND:
+        raise ValueError('can not replace the reference backend')
+    if callable(functions):
+        _BACKENDS[name] = functions
+    else:
+        _BACKENDS[name] = _check_functions(functions)
+    if activate:
+        functions = _backend(name)
+    if activate == 'default':
+        use_backend(name, [func for func in functions
+                           if func not in _BATCHED_FUNCTIONS])
+    elif activate:
+        use_backend(name)
+
+
+def _check_functions(functions):
+    """Return copy of dict of implementations after validating names."""
+    reference = _BACKENDS[_REFERENCE_BACKEND]
+    for func in functions:
+        if func not in reference:
+            raise ValueError('no reference implementation of %s' % func)
+    return dict(functions)
+
+
+def _backend(name):
+    """Return dict of implementations of backend, created on first use."""
+    functions = _BACKENDS[name]
+    if callable(functions):
+        functions = _check_functions(functions())
+        _BACKENDS[name] = functions
+    return functions
+
 
-    Existing attributes with name clashes are renamed with prefix.
-    Attributes starting with underscore are ignored by default.
+def unregister_backend(name):
+    """Remove backend and restore reference implementations of its functions.
 
-    Return True on successful import.
+    """
+    if name == _REFERENCE_BACKEND:
+        raise ValueError('can not remove the reference backend')
+    use_backend(_REFERENCE_BACKEND, [func for func, backend
+                                     in _ACTIVE_BACKEND.items()
+                                     if backend == name])
+    del _BACKENDS[name]
+
+
+def list_backends():
+    """Return names of registered backends, the reference backend first."""
+    return [_REFERENCE_BACKEND] + sorted(
+        name for name in _BACKENDS if name != _REFERENCE_BACKEND)
+
+
+def backend_functions(name):
+    """Return sorted names of functions implemented by backend."""
+    return sorted(_backend(name))
+
+
+def use_backend(name, functions=None):
+    """Activate implementations of backend for functions.
+
+    functions : names of functions to override. By default all functions
+        implemented by the backend. Functions not implemented by the backend
+        raise ValueError.
+
+    The module globals are replaced, i.e. only attributes accessed through
+    the module after the call use the backend.
+
+    >>> use_backend('numpy', ['quaternion_matrix'])
+    >>> active_backend('quaternion_matrix')
+    'numpy'
+    >>> quaternion_matrix is get_implementation('quaternion_matrix')
+    True
+
+    """
+    implementations = _backend(name)
+    if functions is None:
+        functions = list(implementations)
+    elif isinstance(functions, str):
+        functions = [functions]
+    for func in functions:
+        if func not in implementations:
+            raise ValueError('backend %s does not implement %s' % (name, func))
+    for func in functions:
+        globals()[func] = implementations[func]
+        _ACTIVE_BACKEND[func] = name
+
+
+def active_backend(function=None):
+    """Return name of backend of active implementation of function.
+
+    If function is None, return dict of all functions to backend names.
+
+    >>> active_backend()['identity_matrix'] in list_backends()
+    True
+
+    """
+    if function is None:
+        return dict(_ACTIVE_BACKEND)
+    return _ACTIVE_BACKEND[function]
+
+
+def get_implementation(function, backend=None):
+    """Return implementation of function by backend, the active by default."""
+    if backend is None:
+        backend = _ACTIVE_BACKEND[function]
+    return _backend(backend)[function]
+
+
+def _parity_cases():
+    """Return dict of function names to lists of (args, kwargs) test cases."""
+    rand = numpy.random.RandomState(42)
+    angles = [tuple((4*math.pi) * (rand.random_sample(3) - 0.5))
+              for _ in range(3)] + [(0.0, math.pi/2.0, 0.0)]
+    axes = sorted(_AXES2TUPLE) + [(0, 1, 0, 1)]
+    rotations = [_BACKENDS[_REFERENCE_BACKEND]['random_rotation_matrix'](
+        rand.random_sample(3)) for _ in range(3)] + [numpy.identity(4)]
+    quaternions = [rand.random_sample(4) - 0.5 for _ in range(3)]
+    vectors = [rand.random_sample(3) - 0.5 for _ in range(3)]
+    points = rand.random_sample((3, 12))
+    affine = numpy.identity(4)
+    affine[:3] += rand.random_sample((3, 4)) - 0.5
+    # stacks of inputs and buffers for out arguments
+    stack = rand.random_sample((5, 3)) - 0.5
+    stack_angles = (2*math.pi) * (rand.random_sample(5) - 0.5)
+    stack_quaternions = rand.random_sample((5, 4)) - 0.5
+    matrix = numpy.empty((4, 4))
+    matrices = numpy.empty((5, 4, 4))
+    return {
+        'identity_matrix': [((), {})],
+        'translation_matrix': [((v, ), {}) for v in vectors] +
+                              [((vectors[0], ), {'out': matrix})],
+        'reflection_matrix': [((vectors[0], vectors[1]), {})],
+        'rotation_matrix': [((a[0], v), {}) for a, v in zip(angles, vectors)] +
+                           [((0.5, vectors[0], vectors[1]), {}),
+                            ((0.5, [0.0, 0.0, 0.0]), {}),
+                            ((0.5, vectors[0], vectors[1]), {'out': matrix}),
+                            ((stack_angles, vectors[0]), {}),
+                            ((0.5, stack), {}),
+                            ((0.5, vectors[0], stack), {}),
+                            ((stack_angles, stack, stack), {}),
+                            ((stack_angles, stack), {'out': matrices})],
+        'projection_matrix': [
+            ((vectors[0], vectors[1]), {}),
+            ((vectors[0], vectors[1], vectors[2]), {}),
+            ((vectors[0], vectors[1]), {'perspective': vectors[2]}),
+            ((vectors[0], vectors[1]), {'perspective': vectors[2],
+                                        'pseudo': True})],
+        'clip_matrix': [((-1, 1, -1, 1, 1, 3), {}),
+                        ((-1, 1, -1, 1, 1, 3), {'perspective': True})],
+        'scale_matrix': [((1.5, ), {}), ((1.5, vectors[0]), {}),
+                         ((1.5, vectors[0], vectors[1]), {}),
+                         ((1.5, ), {'out': matrix}),
+                         ((1.5, vectors[0], vectors[1]), {'out': matrix})],
+        'shear_matrix': [((0.5, [1, 0, 0], vectors[0], [0, 0, 1]), {})],
+        'superimposition_matrix': [
+            ((points, numpy.dot(rotations[0][:3, :3], points)),
+             {'scale': scale, 'usesvd': usesvd})
+            for scale in (False, True) for usesvd in (True, False)],
+        'affine_matrix_from_points': [
+            ((points, numpy.dot(affine[:3, :3], points)), {})],
+        'orthogonalization_matrix': [(([10, 11, 12], [80, 90, 100]), {})],
+        'euler_matrix': [(a + (x, ), {}) for a in angles for x in axes] +
+                        [(angles[0] + ('rzxz', ), {'out': matrix})],
+        'euler_from_matrix': [((r, x), {}) for r in rotations for x in axes] +
+                             [((rotations[0][:3, :3], 'sxyz'), {}),
+                              ((rotations[0][:2, :2], 'sxyz'), {})],
+        'euler_from_quaternion': [((q, x), {}) for q in quaternions
+                                  for x in axes[:4]],
+        'quaternion_from_euler': [(a + (x, ), {}) for a in angles
+                                  for x in axes],
+        'quaternion_about_axis': [((a[0], v), {})
+                                  for a, v in zip(angles, vectors)],
+        'quaternion_matrix': [((q, ), {}) for q in quaternions] +
+                             [(([0, 0, 0, 0], ), {}),
+                              ((quaternions[0], ), {'out': matrix})],
+        'quaternion_from_matrix': [((r, ), {'isprecise': p})
+                                   for r in rotations for p in (False, True)] +
+                                  [((rotations[0][:3, :3], ), {'isprecise': p})
+                                   for p in (False, True)],
+        'quaternion_multiply': [((q, quaternions[0]), {})
+                                for q in quaternions] +
+                               [((stack_quaternions, quaternions[0]), {}),
+                                ((quaternions[0], stack_quaternions), {}),
+                                ((stack_quaternions, stack_quaternions),
+                                 {'out': numpy.empty((5, 4))})],
+        'quaternion_conjugate': [((q, ), {}) for q in quaternions],
+        'quaternion_inverse': [((q, ), {}) for q in quaternions],
+        'quaternion_slerp': [((quaternions[0], quaternions[1], f), {})
+                             for f in (0.0, 0.3, 1.0)],
+        'inverse_matrix': [((r, ), {}) for r in rotations + [affine]],
+        'concatenate_matrices': [(tuple(rotations), {})],
+        'is_same_transform': [((r, r), {}) for r in rotations] +
+                             [((rotations[0], rotations[1]), {})],
+        'vector_norm': [((v, ), {}) for v in vectors],
+        'unit_vector': [((v, ), {}) for v in vectors],
+        'vector_product': [((vectors[0], vectors[1]), {})],
+        'angle_between_vectors': [((vectors[0], vectors[1]), {})],
+    }
+
+
+def _same_result(a, b, rtol=1e-5, atol=1e-8):
+    """Return True if results of two implementations are close."""
+    if isinstance(a, (tuple, list)) and isinstance(b, (tuple, list)):
+        return len(a) == len(b) and all(
+            _same_result(x, y, rtol, atol) for x, y in zip(a, b))
+    if a is None or b is None:
+        return a is b
+    a = numpy.asarray(a)
+    b = numpy.asarray(b)
+    return a.shape == b.shape and numpy.allclose(a, b, rtol, atol,
+                                                 equal_nan=True)
+
+
+def check_backend(name, functions=None, rtol=1e-5, atol=1e-8):
+    """Compare implementations of backend against the reference backend.
+
+    Return dict of names of failing functions to error messages. Functions
+    without parity test cases fail. Both implementations get separate out
+    buffers, which must hold the same values afterwards. Exceptions raised
+    by the reference implementation must be raised by the backend too.
+
+    >>> check_backend('numpy')
+    {}
+    >>> for name in list_backends():
+    ...     failed = check_backend(name)
+    ...     if failed: print(name, failed)
+
+    """
+    implementations = _backend(name)
+    reference = _BACKENDS[_REFERENCE_BACKEND]
+    cases = _parity_cases()
+    failed = {}
+    if functions is None:
+        functions = sorted(implementations)
+        if name == _REFERENCE_BACKEND:
+            functions = [func for func in functions if func in cases]
+    for func in functions:
+        if func not in cases:
+            failed[func] = 'no parity test cases'
+            continue
+        for args, kwargs in cases[func]:
+            results = []
+            for implementation in (reference[func], implementations[func]):
+                kw = dict(kwargs)
+                if kw.get('out') is not None:
+                    kw['out'] = numpy.zeros_like(kw['out'])
+                try:
+                    result = implementation(*args, **kw)
+                except Exception as exc:
+                    result = exc
+                results.append((result, kw.get('out')))
+            (expected, expected_out), (result, out) = results
+            if isinstance(expected, Exception):
+                if not isinstance(result, type(expected)):
+                    failed[func] = '%s%r returned %r, expected %r' % (
+                        func, args, result, expected)
+                    break
+            elif isinstance(result, Exception):
+                failed[func] = '%s%r raised %r' % (func, args, result)
+                break
+            elif not (_same_result(result, expected, rtol, atol) and
+                      _same_result(out, expected_out, rtol, atol)):
+                failed[func] = '%s%r returned %r, expected %r' % (
+                    func, args, (result, out), (expected, expected_out))
+                break
+    return failed
+
+
+def _extension_backend(name='_transformations'):
+    """Return functions of compiled extension module, if it can be imported.
+
+    The transformations.c extension module is imported as a top-level module.
 
     """
-    import warnings
     from importlib import import_module
     try:
-        if not package:
-            module = import_module(name)
-        else:
-            module = import_module('.' + name, package=package)
+        module = import_module(name)
     except ImportError:
-        if warn:
-            warnings.warn('failed to import module %s' % name)
-    else:
-        for attr in dir(module):
-            if ignore and attr.startswith(ignore):
-                continue
-            if prefix:
-                if attr in globals():
-                    globals()[prefix + attr] = globals()[attr]
-                elif warn:
-                    warnings.warn('no Python implementation of ' + attr)
-            globals()[attr] = getattr(module, attr)
-        return True
-
-
-_import_module('_transformations')
+        return None
+    reference = _BACKENDS[_REFERENCE_BACKEND]
+    return dict((attr, getattr(module, attr)) for attr in dir(module)
+                if not attr.startswith('_') and attr in reference)
+
+
+def _numba_backend():
+    """Return JIT compiled implementations of functions.
+
+    Numba is imported when the backend is first used.
+
+    Inputs that are not supported by the compiled kernels, e.g. stacks of
+    quaternions, are passed to the reference implementations.
+
+    """
+    import numba
+    reference = _BACKENDS[_REFERENCE_BACKEND]
+    # numpy error model: division by zero gives nan as in the reference
+    jit = numba.njit(cache=False, nogil=True, error_model='numpy')
+    eps = _EPS
+    next_axis = numpy.array(_NEXT_AXIS)
+
+    @jit
+    def _euler_matrix(ai, aj, ak, firstaxis, parity, repetition, frame):
+        i = firstaxis
+        j = next_axis[i+parity]
+        k = next_axis[i-parity+1]
+        if frame:
+            ai, ak = ak, ai
+        if parity:
+            ai, aj, ak = -ai, -aj, -ak
+        si, sj, sk = math.sin(ai), math.sin(aj), math.sin(ak)
+        ci, cj, ck = math.cos(ai), math.cos(aj), math.cos(ak)
+        cc, cs = ci*ck, ci*sk
+        sc, ss = si*ck, si*sk
+        M = numpy.identity(4)
+        if repetition:
+            M[i, i] = cj
+            M[i, j] = sj*si
+            M[i, k] = sj*ci
+            M[j, i] = sj*sk
+            M[j, j] = -cj*ss+cc
+            M[j, k] = -cj*cs-sc
+            M[k, i] = -sj*ck
+            M[k, j] = cj*sc+cs
+            M[k, k] = cj*cc-ss
+        else:
+            M[i, i] = cj*ck
+            M[i, j] = sj*sc-cs
+            M[i, k] = sj*cc+ss
+            M[j, i] = cj*sk
+            M[j, j] = sj*ss+cc
+            M[j, k] = sj*cs-sc
+            M[k, i] = -sj
+            M[k, j] = cj*si
+            M[k, k] = cj*ci
+        return M
+
+    @jit
+    def _euler_from_matrix(M, firstaxis, parity, repetition, frame):
+        i = firstaxis
+        j = next_axis[i+parity]
+        k = next_axis[i-parity+1]
+        if repetition:
+            sy = math.sqrt(M[i, j]*M[i, j] + M[i, k]*M[i, k])
+            if sy > eps:
+                ax = math.atan2(M[i, j], M[i, k])
+                ay = math.atan2(sy, M[i, i])
+                az = math.atan2(M[j, i], -M[k, i])
+            else:
+                ax = math.atan2(-M[j, k], M[j, j])
+                ay = math.atan2(sy, M[i, i])
+                az = 0.0
+        else:
+            cy = math.sqrt(M[i, i]*M[i, i] + M[j, i]*M[j, i])
+            if cy > eps:
+                ax = math.atan2(M[k, j], M[k, k])
+                ay = math.atan2(-M[k, i], cy)
+                az = math.atan2(M[j, i], M[i, i])
+            else:
+                ax = math.atan2(-M[j, k], M[j, j])
+                ay = math.atan2(-M[k, i], cy)
+                az = 0.0
+        if parity:
+            ax, ay, az = -ax, -ay, -az
+        if frame:
+            ax, az = az, ax
+        return ax, ay, az
+
+    @jit
+    def _quaternion_matrix(q):
+        n = q[0]*q[0] + q[1]*q[1] + q[2]*q[2] + q[3]*q[3]
+        M = numpy.identity(4)
+        if n < eps:
+            return M
+        s = 2.0 / n
+        ww, wx, wy, wz = s*q[0]*q[0], s*q[0]*q[1], s*q[0]*q[2], s*q[0]*q[3]
+        xx, xy, xz = s*q[1]*q[1], s*q[1]*q[2], s*q[1]*q[3]
+        yy, yz, zz = s*q[2]*q[2], s*q[2]*q[3], s*q[3]*q[3]
+        M[0, 0] = 1.0 - yy - zz
+        M[0, 1] = xy - wz
+        M[0, 2] = xz + wy
+        M[1, 0] = xy + wz
+        M[1, 1] = 1.0 - xx - zz
+        M[1, 2] = yz - wx
+        M[2, 0] = xz - wy
+        M[2, 1] = yz + wx
+        M[2, 2] = 1.0 - xx - yy
+        return M
+
+    @jit
+    def _quaternion_from_matrix_precise(M):
+        q = numpy.empty(4)
+        t = M[0, 0] + M[1, 1] + M[2, 2] + M[3, 3]
+        if t > M[3, 3]:
+            q[0] = t
+            q[3] = M[1, 0] - M[0, 1]
+            q[2] = M[0, 2] - M[2, 0]
+            q[1] = M[2, 1] - M[1, 2]
+        else:
+            i, j, k = 0, 1, 2
+            if M[1, 1] > M[0, 0]:
+                i, j, k = 1, 2, 0
+            if M[2, 2] > M[i, i]:
+                i, j, k = 2, 0, 1
+            t = M[i, i] - (M[j, j] + M[k, k]) + M[3, 3]
+            q[i+1] = t
+            q[j+1] = M[i, j] + M[j, i]
+            q[k+1] = M[k, i] + M[i, k]
+            q[0] = M[k, j] - M[j, k]
+        q *= 0.5 / math.sqrt(t * M[3, 3])
+        if q[0] < 0.0:
+            q *= -1.0
+        return q
+
+    @jit
+    def _quaternion_multiply(q1, q0):
+        w0, x0, y0, z0 = q0[0], q0[1], q0[2], q0[3]
+        w1, x1, y1, z1 = q1[0], q1[1], q1[2], q1[3]
+        q = numpy.empty(4)
+        q[0] = -x1*x0 - y1*y0 - z1*z0 + w1*w0
+        q[1] = x1*w0 + y1*z0 - z1*y0 + w1*x0
+        q[2] = -x1*z0 + y1*w0 + z1*x0 + w1*y0
+        q[3] = x1*y0 - y1*x0 + z1*w0 + w1*z0
+        return q
+
+    @jit
+    def _rotation_matrix(angle, direction, point, haspoint):
+        sina = math.sin(angle)
+        cosa = math.cos(angle)
+        n = math.sqrt(direction[0]*direction[0] + direction[1]*direction[1] +
+                      direction[2]*direction[2])
+        x, y, z = direction[0] / n, direction[1] / n, direction[2] / n
+        M = numpy.identity(4)
+        M[0, 0] = cosa + x*x*(1.0-cosa)
+        M[0, 1] = x*y*(1.0-cosa) - z*sina
+        M[0, 2] = x*z*(1.0-cosa) + y*sina
+        M[1, 0] = x*y*(1.0-cosa) + z*sina
+        M[1, 1] = cosa + y*y*(1.0-cosa)
+        M[1, 2] = y*z*(1.0-cosa) - x*sina
+        M[2, 0] = x*z*(1.0-cosa) - y*sina
+        M[2, 1] = y*z*(1.0-cosa) + x*sina
+        M[2, 2] = cosa + z*z*(1.0-cosa)
+        if haspoint:
+            for i in range(3):
+                M[i, 3] = point[i] - (M[i, 0]*point[0] + M[i, 1]*point[1] +
+                                      M[i, 2]*point[2])
+        return M
+
+    def euler_matrix(ai, aj, ak, axes='sxyz', out=None):
+        if out is not None:
+            return reference['euler_matrix'](ai, aj, ak, axes, out)
+        return _astype(_euler_matrix(float(ai), float(aj), float(ak),
+                                     *_euler_axes(axes)))
+
+    def euler_from_matrix(matrix, axes='sxyz'):
+        M = numpy.array(matrix, dtype=numpy.float64, copy=False)[:3, :3]
+        if M.shape != (3, 3):
+            return reference['euler_from_matrix'](matrix, axes)
+        return _euler_from_matrix(numpy.ascontiguousarray(M),
+                                  *_euler_axes(axes))
+
+    def quaternion_matrix(quaternion, out=None):
+        q = numpy.array(quaternion, dtype=numpy.float64, copy=False)
+        if out is not None or q.shape != (4, ):
+            return reference['quaternion_matrix'](quaternion, out)
+        return _astype(_quaternion_matrix(q))
+
+    def quaternion_from_matrix(matrix, isprecise=False):
+        M = numpy.array(matrix, dtype=numpy.float64, copy=False)[:4, :4]
+        if not isprecise or M.shape != (4, 4):
+            return reference['quaternion_from_matrix'](matrix, isprecise)
+        return _astype(
+            _quaternion_from_matrix_precise(numpy.ascontiguousarray(M)))
+
+    def quaternion_multiply(quaternion1, quaternion0, out=None):
+        q0 = numpy.array(quaternion0, dtype=numpy.float64, copy=False)
+        q1 = numpy.array(quaternion1, dtype=numpy.float64, copy=False)
+        if out is not None or q0.shape != (4, ) or q1.shape != (4, ):
+            return reference['quaternion_multiply'](q1, q0, out)
+        return _astype(_quaternion_multiply(q1, q0))
+
+    def rotation_matrix(angle, direction, point=None, out=None):
+        direction = numpy.array(direction, dtype=numpy.float64, copy=False)
+        if out is not None or _ndim(angle) or direction.shape != (3, ) or (
+                point is not None and _ndim(point) > 1):
+            return reference['rotation_matrix'](angle, direction, point, out)
+        if point is None:
+            return _astype(_rotation_matrix(float(angle), direction,
+                                            direction, False))
+        point = numpy.array(point, dtype=numpy.float64, copy=False)[:3]
+        return _astype(_rotation_matrix(float(angle), direction, point, True))
+
+    functions = dict((func.__name__, func) for func in (
+        euler_matrix, euler_from_matrix, quaternion_matrix,
+        quaternion_from_matrix, quaternion_multiply, rotation_matrix))
+    for name, func in functions.items():
+        func.__doc__ = reference[name].__doc__
+    return functions
+
+
+def _register_default_backends():
+    """Register the compiled extension and JIT backends if available.
+
+    As before the backend registry existed, implementations of the compiled
+    extension module override the reference implementations on import,
+    except for functions whose reference implementations accept batches.
+    The JIT backend is registered if numba is installed, but numba is only
+    imported when the backend is used, e.g. by use_backend('numba').
+
+    """
+    from importlib.util import find_spec
+    functions = _extension_backend()
+    if functions:
+        register_backend('c', functions, activate='default')
+    if find_spec('numba') is not None:
+        register_backend('numba', _numba_backend)
+
+
+_register_default_backends()
 
 if __name__ == '__main__':
     import doctest